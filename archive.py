@@ -0,0 +1,39 @@
+from boto3.dynamodb.types import TypeDeserializer
+import dynamodb
+
+deserializer = TypeDeserializer()
+
+
+def is_expired(record):
+    """Whether the stream record is a delete made by TTL rather than by the user."""
+    identity = record.get('userIdentity') or {}
+    return record['eventName'] == 'REMOVE' and identity.get('type') == 'Service' and \
+        identity.get('principalId') == 'dynamodb.amazonaws.com'
+
+
+def history_item(image):
+    item = {key: deserializer.deserialize(value) for key, value in image.items()}
+    deadline, id = item['uniqueDeadline'].split('&')
+    history = {
+        'userId': item['userId'],
+        'sortDeadline': item.get('sortDeadline') or dynamodb.sort_deadline(deadline, id),
+        'text': item['text']
+    }
+    if item.get('timeBy'):
+        history['timeBy'] = item['timeBy']
+    return history
+
+
+def lambda_handler(event, context):
+    """Moves reminders expired by TTL on the reminders stream into reminderHistory."""
+    archived = 0
+    with dynamodb.history_table.batch_writer(overwrite_by_pkeys=['userId', 'sortDeadline']) as batch:
+        for record in event.get('Records', []):
+            if not is_expired(record):
+                continue
+            batch.put_item(Item=history_item(record['dynamodb']['OldImage']))
+            archived += 1
+    return {
+        'statusCode': 200,
+        'body': 'Archived {}'.format(archived)
+    }
@@ -0,0 +1,14 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# The boto3 calls in dynamodb.py block, so they run on this pool to keep the event loop free
+# for Telegram API calls. boto3 clients are thread-safe and the table resources only forward
+# their calls to the client.
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='dynamodb')
+
+
+async def run_sync(func, *args, **kwargs):
+    """Runs a blocking call on the executor and waits for it without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
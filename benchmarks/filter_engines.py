@@ -0,0 +1,52 @@
+"""Latency and memory of the two match_date engines, 'nltk' and 'rules', over the sample
+statements. Every engine is measured in a fresh interpreter, so its peak memory includes loading
+what it needs (the POS tagger and chunk parser for nltk):
+
+    python benchmarks/filter_engines.py 200
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def measure(engine, rounds):
+    import filter
+    statements = filter.statements_1 + filter.statements_2 + ['call my friend', 'money for the month']
+    reference_date = datetime.date(2022, 8, 15)
+    parse = filter.engines[engine]
+    tracemalloc.start()
+    start = time.perf_counter()
+    parse(statements[0], reference_date)
+    first = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The cache is bypassed, every call parses
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for statement in statements:
+            parse(statement, reference_date)
+    per_statement = (time.perf_counter() - start) / (rounds * len(statements))
+    return {'engine': engine, 'first_ms': first * 1000, 'per_statement_us': per_statement * 1e6,
+            'peak_kb': peak / 1024}
+
+
+def main(rounds):
+    print('{:>8} {:>14} {:>18} {:>10}'.format('engine', 'first parse ms', 'per statement us', 'peak KB'))
+    for engine in ('nltk', 'rules'):
+        output = subprocess.run([sys.executable, __file__, '--child', engine, str(rounds)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        print('{engine:>8} {first_ms:>14.1f} {per_statement_us:>18.1f} {peak_kb:>10.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        print(json.dumps(measure(sys.argv[2], int(sys.argv[3]))))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,63 @@
+"""Per-message latency of match_date's date_prefilter on a mix of links, plain notes and real
+reminders, against running the nltk engine on every message. The match_date cache is bypassed:
+
+    python benchmarks/filter_prefilter.py 200
+"""
+import os
+import sys
+import time
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import filter
+
+messages = {
+    'links': ['https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'check this out https://example.com/docs/setup',
+              'https://github.com/algebananazzzzz/AnelaBot/pull/12', 'www.straitstimes.com/singapore',
+              'https://maps.app.goo.gl/xyz123 meet here', 'https://docs.google.com/spreadsheets/d/1AbC/edit'],
+    'notes': ['remember to call back', 'buy milk and eggs', 'the wedding photos are up', 'lol', 'ok see you',
+              'money for the month', 'satisfied with the result', 'read chapter 3', 'pick up the parcel',
+              'water the plants', 'great job everyone', 'call my friend', 'sunshine is nice', 'meeting notes'],
+    'reminders': filter.statements_1 + filter.statements_2,
+}
+reference_date = datetime.date(2022, 8, 15)
+
+
+def with_prefilter(statement):
+    if not filter.date_prefilter.search(statement):
+        return None
+    return filter.parse_date(statement, reference_date)
+
+
+def without_prefilter(statement):
+    return filter.parse_date(statement, reference_date)
+
+
+def latency(parse, statements, rounds, repeat=3):
+    """Best of repeat runs, in microseconds per message."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for statement in statements:
+                parse(statement)
+        elapsed = (time.perf_counter() - start) / (rounds * len(statements)) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(rounds):
+    # Load the models outside the measurements
+    without_prefilter(filter.statements_1[0])
+    mixed = [statement for statements in messages.values() for statement in statements]
+    print('{:>10} {:>8} {:>16} {:>19}'.format('messages', 'passed', 'prefilter us', 'no prefilter us'))
+    for name, statements in list(messages.items()) + [('mixed', mixed)]:
+        passed = sum(1 for statement in statements if filter.date_prefilter.search(statement))
+        print('{:>10} {:>8} {:>16.1f} {:>19.1f}'.format(name, '{}/{}'.format(passed, len(statements)),
+                                                       latency(with_prefilter, statements, rounds),
+                                                       latency(without_prefilter, statements, rounds)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,52 @@
+"""Cold start of filter.py: import time, and time to the first parse with the nltk engine, with
+the models loaded from NLTK_DATA and from a FILTER_SNAPSHOT written by save_snapshot(). Every
+case runs in a fresh interpreter:
+
+    python benchmarks/filter_startup.py 5
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+child = """
+import sys, time, json, datetime
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import filter
+imported = time.perf_counter()
+filter.match_date('buy hamster by tomorrow 1830', datetime.date(2022, 8, 15), engine='nltk')
+parsed = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'first_parse_ms': (parsed - imported) * 1000,
+                  'nltk_imported': 'nltk' in sys.modules}}))
+"""
+
+
+def run(env, repeat):
+    results = [json.loads(subprocess.run([sys.executable, '-c', child.format(root=root)], env=env,
+                                         capture_output=True, text=True, check=True).stdout)
+               for _ in range(repeat)]
+    return {key: sorted(result[key] for result in results)[len(results) // 2]
+            for key in ('import_ms', 'first_parse_ms')}
+
+
+def main(repeat):
+    env = dict(os.environ)
+    env.pop('FILTER_SNAPSHOT', None)
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = os.path.join(directory, 'filter.pickle')
+        subprocess.run([sys.executable, '-c', 'import sys; sys.path.insert(0, {!r}); import filter; filter.save_snapshot({!r})'.format(root, snapshot)],
+                       env=env, check=True)
+        cases = [('NLTK_DATA', env), ('FILTER_SNAPSHOT', dict(env, FILTER_SNAPSHOT=snapshot))]
+        print('{:>16} {:>10} {:>15}'.format('models from', 'import ms', 'first parse ms'))
+        for name, case_env in cases:
+            result = run(case_env, repeat)
+            print('{:>16} {:>10.1f} {:>15.1f}'.format(name, result['import_ms'], result['first_parse_ms']))
+        print('median of {} runs, snapshot {:.1f} MB'.format(repeat, os.path.getsize(snapshot) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
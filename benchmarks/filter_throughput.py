@@ -0,0 +1,66 @@
+"""Parse throughput of the nltk engine over statements_1, statements_2 and the same number of
+notes without a date, with the match_date cache bypassed:
+
+    python benchmarks/filter_throughput.py 200
+
+'before' is the pipeline as it was: word_tokenize twice, a RegexpTagger and POS tagging every
+statement. 'tokenize' is filter.tokenize, which tokenizes once. 'parse_date' also skips POS
+tagging when no token can be a date.
+"""
+import os
+import sys
+import time
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nltk
+import filter
+
+notes = ['check out https://example.com/docs', 'remember to call back', 'the wedding photos are up',
+         'buy milk and eggs', 'money for the month', 'lol', 'ok see you', 'satisfied with the result',
+         'sunshine is nice', 'read chapter 3', 'meeting notes', 'pick up the parcel', 'call my friend',
+         'water the plants', 'Tmrw maybe', 'sent the invoice', 'great job everyone', 'update the slides']
+reference_date = datetime.date(2022, 8, 15)
+
+
+def before(statement, reg_tagger=nltk.RegexpTagger(list(filter.patterns.items()))):
+    from nltk.tokenize import word_tokenize
+    reg_out = reg_tagger.tag(word_tokenize(statement))
+    tag_out = filter.get_pos_tagger().tag(word_tokenize(statement))
+    tagged = filter.merge_tags(reg_out, tag_out)
+    return filter.resolve_tree(filter.get_chunk_parser().parse(tagged), reference_date)
+
+
+def tokenize(statement):
+    return filter.resolve_tree(filter.get_chunk_parser().parse(filter.tokenize(statement)), reference_date)
+
+
+def parse_date(statement):
+    return filter.parse_date(statement, reference_date)
+
+
+def throughput(parse, statements, rounds, repeat=3):
+    """Best of repeat runs, so one slow run doesn't decide the comparison."""
+    best = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for statement in statements:
+                parse(statement)
+        best = max(best, rounds * len(statements) / (time.perf_counter() - start))
+    return best
+
+
+def main(rounds):
+    dated = filter.statements_1 + filter.statements_2
+    # Load the models outside the measurements
+    parse_date(dated[0])
+    print('{:>12} {:>16} {:>16}'.format('pipeline', 'dated per s', 'mixed per s'))
+    for parse in (before, tokenize, parse_date):
+        print('{:>12} {:>16.0f} {:>16.0f}'.format(parse.__name__, throughput(parse, dated, rounds),
+                                                  throughput(parse, dated + notes, rounds)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
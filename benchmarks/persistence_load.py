@@ -0,0 +1,132 @@
+"""Cold-start cost of MyPersistence with many stored users: the original getters, which
+unpickled every entry into live objects and deep-copied them for PTB, against blob and sharded
+mode with serialized snapshots.
+
+Runs against fakeredis, so the numbers are the decoding, copying and bookkeeping done in the
+Lambda rather than network time. Latency and tracemalloc peak memory are measured in separate
+runs, since tracing slows everything down:
+
+    python benchmarks/persistence_load.py 10000 100000
+"""
+import os
+import sys
+import time
+import pickle
+import asyncio
+import uuid
+import tracemalloc
+from collections import defaultdict
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('REDIS_KEY', 'bench')
+
+import fakeredis
+import mypersistence
+from telegram.ext import PersistenceInput
+
+
+class DeepcopyPersistence(object):
+    """The sharded getters as they were before snapshots: every entry is unpickled on load and
+    get_user_data hands PTB a deep copy of all of them."""
+
+    def __init__(self):
+        self.user_data = None
+        self.conversations = None
+        self.pending = set()
+
+    def load_redis(self):
+        conn = mypersistence.redis_conn
+        self.conversations = dict()
+        for field, state in conn.hgetall('bench:conversations').items():
+            name, key = mypersistence.parse_conversation_field(field)
+            self.conversations.setdefault(name, dict())[key] = pickle.loads(state)
+        self.user_data = defaultdict(dict, {int(user_id): pickle.loads(data)
+                                            for user_id, data in conn.hgetall('bench:user_data').items()})
+
+    async def get_user_data(self):
+        if not self.user_data:
+            self.load_redis()
+        return deepcopy(self.user_data)
+
+    async def get_conversations(self, name):
+        if not self.conversations:
+            self.load_redis()
+        return self.conversations.get(name, dict()).copy()
+
+    async def refresh_user_data(self, user_id, data):
+        pass
+
+    async def update_user_data(self, user_id, data):
+        if self.user_data.get(user_id) != data:
+            self.user_data[user_id] = data
+            self.pending.add(user_id)
+
+    async def update_conversation(self, name, key, state):
+        self.conversations.setdefault(name, dict())[key] = state
+
+    async def flush(self):
+        for user_id in self.pending:
+            mypersistence.redis_conn.hset('bench:user_data', str(user_id), pickle.dumps(self.user_data[user_id]))
+
+
+def user_data(i):
+    return {'reminder_id': str(uuid.UUID(int=i)), 'page_data': {1: '01#02#2027&' + str(uuid.UUID(int=i))}}
+
+
+def persistence(mode):
+    if mode == 'original':
+        return DeepcopyPersistence()
+    # The original stored pickle, so the snapshot modes are measured with it too
+    return mypersistence.MyPersistence(None, 'bench', PersistenceInput(chat_data=False, bot_data=False), 60,
+                                       sharded=mode == 'sharded', serializer=mypersistence.PickleSerializer())
+
+
+async def populate(users, mode):
+    mypersistence.redis_conn = fakeredis.FakeStrictRedis()
+    # Original and sharded mode share the hash layout
+    p = mypersistence.MyPersistence(None, 'bench', PersistenceInput(chat_data=False, bot_data=False), 60,
+                                    sharded=mode != 'blob', serializer=mypersistence.PickleSerializer())
+    p.load_redis()
+    for i in range(users):
+        await p.update_user_data(i, user_data(i))
+        await p.update_conversation('anela_conversation', (i, i), 0)
+    await p.flush()
+
+
+async def invocation(mode):
+    """What one update costs on a cold container: load, hand PTB its data, touch one user, flush."""
+    p = persistence(mode)
+    all_user_data = await p.get_user_data()
+    await p.get_conversations('anela_conversation')
+    data = all_user_data[7]
+    await p.refresh_user_data(7, data)
+    data['reminder_id'] = 'changed'
+    await p.update_user_data(7, data)
+    await p.update_conversation('anela_conversation', (7, 7), 1)
+    await p.flush()
+    # PTB keeps what the getters returned for the life of the container
+    return p, all_user_data
+
+
+def main(sizes):
+    loop = asyncio.new_event_loop()
+    print('{:>8} {:>9} {:>10} {:>10}'.format('users', 'mode', 'cold ms', 'peak MB'))
+    for users in sizes:
+        for mode in ('original', 'blob', 'sharded'):
+            loop.run_until_complete(populate(users, mode))
+            start = time.perf_counter()
+            loop.run_until_complete(invocation(mode))
+            elapsed = (time.perf_counter() - start) * 1000
+
+            loop.run_until_complete(populate(users, mode))
+            tracemalloc.start()
+            kept = loop.run_until_complete(invocation(mode))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del kept
+            print('{:>8} {:>9} {:>10.1f} {:>10.1f}'.format(users, mode, elapsed, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [10000, 100000])
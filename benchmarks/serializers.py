@@ -0,0 +1,55 @@
+"""Size and encode/decode latency of the persistence formats, for a typical user_data entry, a
+conversation state and a blob holding many users:
+
+    python benchmarks/serializers.py 1000
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('REDIS_KEY', 'bench')
+
+import mypersistence
+
+
+def user_data(i):
+    return {'reminder_id': str(uuid.UUID(int=i)),
+            'page_data': {page: '01#02#2027&' + str(uuid.UUID(int=i * 10 + page)) for page in range(1, 4)}}
+
+
+def serializers():
+    yield 'pickle', mypersistence.PickleSerializer()
+    yield 'msgpack', mypersistence.MsgpackSerializer()
+    yield 'msgpack+zlib', mypersistence.MsgpackSerializer(compression='zlib')
+    if mypersistence.lz4 is not None:
+        yield 'msgpack+lz4', mypersistence.MsgpackSerializer(compression='lz4')
+
+
+def measure(serializer, obj, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = serializer.dumps(obj)
+    dumped = time.perf_counter()
+    for _ in range(repeat):
+        serializer.loads(data)
+    loaded = time.perf_counter()
+    return len(data), (dumped - start) / repeat * 1e6, (loaded - dumped) / repeat * 1e6
+
+
+def main(users):
+    payloads = [
+        ('user entry', user_data(1), 10000),
+        ('conversation', 0, 10000),
+        ('{} users'.format(users), {'user_data': {i: user_data(i) for i in range(users)}}, 20),
+    ]
+    print('{:>14} {:>14} {:>10} {:>12} {:>12}'.format('payload', 'format', 'bytes', 'dumps us', 'loads us'))
+    for name, obj, repeat in payloads:
+        for format, serializer in serializers():
+            size, dumps, loads = measure(serializer, obj, repeat)
+            print('{:>14} {:>14} {:>10} {:>12.1f} {:>12.1f}'.format(name, format, size, dumps, loads))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
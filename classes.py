@@ -1,5 +1,94 @@
+import os
+import json
+import time
 import dynamodb
 import datetime
+from collections import OrderedDict
+
+
+class IdentityMap(object):
+    """Objects read or written during the current update, so that each is read from DynamoDB at
+    most once. Cleared at the start of every invocation."""
+
+    def __init__(self):
+        super(IdentityMap, self).__init__()
+        self.users = dict()
+        self.reminders = dict()
+
+    def clear(self):
+        self.users.clear()
+        self.reminders.clear()
+
+
+identity_map = IdentityMap()
+
+
+class UserCache(object):
+    """Write-through cache of user settings across invocations: Redis in front of the users table,
+    with a small LRU in the container. With redis_conn set, every read checks Redis so settings
+    saved by another container are seen at once, and the local entries only serve while Redis
+    can't be reached. Without it they expire after ttl seconds.
+
+    Redis keys start with redis_key, like those of MyPersistence, so deployments sharing a Redis
+    keep their users apart."""
+
+    def __init__(self, maxsize=1024, ttl=60, redis_conn=None, redis_ttl=86400, redis_key=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_conn = redis_conn
+        self.redis_ttl = redis_ttl
+        self.prefix = '{}:user'.format(redis_key) if redis_key else 'user'
+        self.entries = OrderedDict()
+
+    def redis_key(self, user_id):
+        return '{}:{}'.format(self.prefix, user_id)
+
+    def get(self, user_id):
+        """Returns (found, settings), settings being None for users that do not exist."""
+        if self.redis_conn is not None:
+            try:
+                data = self.redis_conn.get(self.redis_key(user_id))
+            except Exception:
+                pass
+            else:
+                if data is None:
+                    self.entries.pop(user_id, None)
+                    return False, None
+                settings = json.loads(data)
+                self.put(user_id, settings, shared=False)
+                return True, settings
+        if user_id in self.entries:
+            expires, settings = self.entries[user_id]
+            if expires > time.monotonic():
+                self.entries.move_to_end(user_id)
+                return True, settings
+            del self.entries[user_id]
+        return False, None
+
+    def put(self, user_id, settings, shared=True):
+        self.entries[user_id] = (time.monotonic() + self.ttl, settings)
+        self.entries.move_to_end(user_id)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        if shared and self.redis_conn is not None:
+            try:
+                self.redis_conn.set(self.redis_key(user_id), json.dumps(settings), ex=self.redis_ttl)
+            except Exception:
+                pass
+
+    def invalidate(self, user_id):
+        self.entries.pop(user_id, None)
+        if self.redis_conn is not None:
+            try:
+                self.redis_conn.delete(self.redis_key(user_id))
+            except Exception:
+                pass
+
+    def clear(self):
+        self.entries.clear()
+
+
+user_cache = UserCache(redis_key=os.environ.get('REDIS_KEY'))
 
 
 class UserObject(object):
@@ -14,23 +103,30 @@ class UserObject(object):
         self.wake_time = wake_time
 
     def get_user(user_id):
-        user = dynamodb.query_user(user_id)
+        if user_id in identity_map.users:
+            return identity_map.users[user_id]
+        found, settings = user_cache.get(user_id)
+        if not found:
+            user = dynamodb.query_user(user_id)
+            if user:
+                settings = {'remind_setting': int(user['remindSetting']), 'timezone_offset': int(
+                    user['timezoneOffset']), 'wake_time': int(user['wakeTime'])}
+            else:
+                settings = None
+            user_cache.put(user_id, settings)
 
-        if user:
-            return UserObject(user_id=user_id, remind_setting=int(user['remindSetting']), timezone_offset=int(user['timezoneOffset']), wake_time=int(user['wakeTime']))
+        if settings:
+            user = UserObject(user_id=user_id, **settings)
         else:
-            return None
+            user = None
+        identity_map.users[user_id] = user
+        return user
 
-    def users(wake_time=None):
-        if wake_time:
-            users = dynamodb.query_users(wake_time)
-        else:
-            users = dynamodb.query_users()
-        data = list()
-        for user in users:
-            data.append(UserObject(user_id=user['userId'], remind_setting=int(
-                user['remindSetting']), timezone_offset=int(user['timezoneOffset']), wake_time=int(user['wakeTime'])))
-        return data
+    def users(wake_time=None, segments=1):
+        """Yields users one at a time, so large user bases are never held in memory at once."""
+        for user in dynamodb.iter_users(wake_time, segments=segments):
+            yield UserObject(user_id=int(user['userId']), remind_setting=int(
+                user['remindSetting']), timezone_offset=int(user['timezoneOffset']), wake_time=int(user['wakeTime']))
 
     # def tupled(self):
     #     return tuple(self.__dict__.values())
@@ -41,27 +137,26 @@ class UserObject(object):
     def reminders(self, deadline=None):
         if deadline:
             deadline = deadline.strftime('%d#%m#%Y')
-        reminders = dynamodb.query_reminders(self.user_id, deadline)
-
-        data = list()
-        for i in reminders:
-            unique_deadline = i['uniqueDeadline'].split('&')
-            reminder = ReminderObject(user_id=i['userId'], text=i['text'], deadline=datetime.datetime.strptime(
-                unique_deadline[0], '%d#%m#%Y').date(), id=unique_deadline[1])
-            if i['timeBy']:
-                reminder.time_by = datetime.datetime.strptime(
-                    i['timeBy'], '%H#%M').time()
-            data.append(reminder)
 
-        return data
+        for i in dynamodb.iter_reminders(self.user_id, deadline):
+            yield ReminderObject.from_item(i)
 
     def save(self):
-        user = dynamodb.query_user(self.user_id)
-        if user:
-            dynamodb.update_user(user_id=self.user_id, remind_setting=self.remind_setting,
+        # New users get the defaults add_user would give them
+        if self.timezone_offset is None:
+            self.timezone_offset = 8
+        if self.wake_time is None:
+            self.wake_time = 0
+        try:
+            dynamodb.upsert_user(user_id=self.user_id, remind_setting=self.remind_setting,
                                  timezone_offset=self.timezone_offset, wake_time=self.wake_time)
-        else:
-            dynamodb.add_user(user_id=self.user_id)
+        except Exception:
+            # The write may or may not have landed, so make the next read go to DynamoDB
+            user_cache.invalidate(self.user_id)
+            raise
+        user_cache.put(self.user_id, {'remind_setting': int(self.remind_setting), 'timezone_offset': int(
+            self.timezone_offset), 'wake_time': int(self.wake_time)})
+        identity_map.users[self.user_id] = self
         return True
 
 
@@ -69,13 +164,26 @@ class ReminderObject(object):
     """docstring for ReminderObject."""
     ACADEMICS, CCA, WORK, FAMILY, SCHEDULES, TODO, FUN_STUFF, OTHERS = range(8)
 
-    def __init__(self, user_id, text, deadline=datetime.date.today(), time_by=None, id=None):
+    def __init__(self, user_id, text, deadline=datetime.date.today(), time_by=None, id=None, due_at=None):
         super(ReminderObject, self).__init__()
         self.user_id = user_id
         self.text = text
         self.deadline = deadline
         self.time_by = time_by
         self.id = id
+        # UTC datetime the reminder fires at, set for reminders with a time_by
+        self.due_at = due_at
+
+    def from_item(i):
+        unique_deadline = i['uniqueDeadline'].split('&')
+        reminder = ReminderObject(user_id=i['userId'], text=i['text'], deadline=datetime.datetime.strptime(
+            unique_deadline[0], '%d#%m#%Y').date(), id=unique_deadline[1])
+        if i['timeBy']:
+            reminder.time_by = datetime.datetime.strptime(
+                i['timeBy'], '%H#%M').time()
+        if i.get('dueAt'):
+            reminder.due_at = datetime.datetime.strptime(i['dueAt'], '%Y-%m-%dT%H:%M')
+        return reminder
 
     # def tupled(self):
     #     return tuple(self.__dict__.values())
@@ -91,53 +199,80 @@ class ReminderObject(object):
         return self.deadline.strftime('%d %b %y')
 
     def get_reminder(id):
+        if id in identity_map.reminders:
+            return identity_map.reminders[id]
         i = dynamodb.query_reminder(id)
 
         if i:
-            unique_deadline = i['uniqueDeadline'].split('&')
-            reminder = ReminderObject(user_id=i['userId'], text=i['text'], deadline=datetime.datetime.strptime(
-                unique_deadline[0], '%d#%m#%Y').date(), id=unique_deadline[1])
-            if i['timeBy']:
-                reminder.time_by = datetime.datetime.strptime(
-                    i['timeBy'], '%H#%M').time()
+            reminder = ReminderObject.from_item(i)
+            identity_map.reminders[id] = reminder
             return reminder
         else:
             raise Exception("No reminder object associated")
 
+    def due_reminders(start, end=None):
+        """Yields the reminders due between the UTC datetimes start and end, to the minute."""
+        end = end or start
+        for i in dynamodb.iter_due_reminders(start.strftime('%Y-%m-%dT%H:%M'), end.strftime('%Y-%m-%dT%H:%M')):
+            yield ReminderObject.from_item(i)
+
     def reminders_by_page(user_id, last_evaluated_key=None):
         query = dynamodb.query_reminders_page(user_id, last_evaluated_key)
 
         data = list()
         for i in query['reminders']:
-            unique_deadline = i['uniqueDeadline'].split('&')
-            reminder = ReminderObject(user_id=i['userId'], text=i['text'], deadline=datetime.datetime.strptime(
-                unique_deadline[0], '%d#%m#%Y').date(), id=unique_deadline[1])
-            if i['timeBy']:
-                reminder.time_by = datetime.datetime.strptime(
-                    i['timeBy'], '%H#%M').time()
-            data.append(reminder)
+            data.append(ReminderObject.from_item(i))
         return {'reminders': data, 'last_evaluated_key': query['LastEvaluatedKey']}
 
-    def save(self):
+    def params(self):
+        """The reminder as arguments to the dynamodb reminder functions."""
         if self.time_by:
             time_by = self.time_by.strftime('%H#%M')
         else:
             time_by = None
+        if self.due_at:
+            due_at = self.due_at.strftime('%Y-%m-%dT%H:%M')
+        else:
+            due_at = None
+        return {'user_id': self.user_id, 'text': self.text, 'deadline': self.deadline.strftime('%d#%m#%Y'),
+                'time_by': time_by, 'due_at': due_at}
+
+    def save(self):
+        params = self.params()
         if self.id:
-            dynamodb.update_reminder(id=self.id, text=self.text, deadline=self.deadline.strftime(
-                '%d#%m#%Y'), time_by=time_by)
+            del params['user_id']
+            dynamodb.update_reminder(id=self.id, **params)
         else:
-            self.id = dynamodb.add_reminder(
-                user_id=self.user_id, text=self.text, deadline=self.deadline.strftime('%d#%m#%Y'), time_by=time_by)
+            self.id = dynamodb.add_reminder(**params)
+        identity_map.reminders[self.id] = self
         return self
 
+    def save_many(reminders):
+        """Saves reminders in batches of 25. Unlike save, existing reminders are overwritten
+        whole rather than updated."""
+        params = list()
+        for reminder in reminders:
+            params.append(dict(reminder.params(), id=reminder.id))
+        ids = dynamodb.put_reminders(params)
+        for reminder, id in zip(reminders, ids):
+            reminder.id = id
+            identity_map.reminders[id] = reminder
+        return reminders
+
+    def delete_many(reminders):
+        dynamodb.delete_reminders_by_id([reminder.id for reminder in reminders])
+        for reminder in reminders:
+            identity_map.reminders.pop(reminder.id, None)
+        return True
+
     def delete_by_params(user_id, deadline):
         if not isinstance(deadline, datetime.date):
             raise TypeError(
                 "Expected deadline of type datetime.date, got some other type instead.")
-        dynamodb.delete_reminders(user_id=user_id, deadline=deadline)
-        return True
+        reminders = [ReminderObject.from_item(i) for i in dynamodb.iter_reminders(user_id, deadline.strftime('%d#%m#%Y'))]
+        return ReminderObject.delete_many(reminders)
 
     def delete(self):
         dynamodb.delete_reminder(self.id)
+        identity_map.reminders.pop(self.id, None)
         return True
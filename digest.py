@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import datetime
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter
+from telegram.request import HTTPXRequest
+from classes import UserObject
+from async_dynamodb import run_sync
+from runtime import run
+from ratelimit import RateLimiter
+
+# Telegram allows a bot about 30 messages per second to different chats
+rate = float(os.environ.get('DIGEST_RATE', 30))
+concurrency = int(os.environ.get('DIGEST_CONCURRENCY', 16))
+
+# Kept across invocations of a warm container, like the application in lambda_function.py. Its
+# HTTPX pool is bound to runtime.loop, and getMe only runs on the first initialize().
+bot = Bot(os.environ.get('TOKEN'), request=HTTPXRequest(connection_pool_size=concurrency))
+
+
+def digest_hour(event):
+    """The UTC hour being served, taken from the scheduled event so retries serve the same batch."""
+    if 'hour' in event:
+        return int(event['hour'])
+    if 'time' in event:
+        return datetime.datetime.strptime(event['time'], '%Y-%m-%dT%H:%M:%SZ').hour
+    return datetime.datetime.utcnow().hour
+
+
+def due_users(hour):
+    """Users whose wake time falls on this UTC hour. Wake times are stored as the local hour minus
+    the timezone offset, so users east of UTC can have negative ones."""
+    for wake_time in (hour, hour - 24):
+        for user in UserObject.users(wake_time):
+            if user.remind_setting:
+                yield user
+
+
+def digest_text(reminders):
+    lines = ["Good morning! Here's what you have today:\n"]
+    for i, reminder in enumerate(sorted(reminders, key=lambda r: (r.time_by is None, r.time_by or datetime.time())), 1):
+        if reminder.time_by:
+            lines.append('{}. {} (by {})'.format(i, reminder.text, reminder.time_by.strftime('%H:%M')))
+        else:
+            lines.append('{}. {}'.format(i, reminder.text))
+    return '\n'.join(lines)
+
+
+async def send_digest(bot, limiter, user, now, stats):
+    local_date = (now + datetime.timedelta(hours=user.timezone_offset)).date()
+    reminders = await run_sync(lambda: list(user.reminders(local_date)))
+    if not reminders:
+        stats['empty'] += 1
+        return
+    text = digest_text(reminders)
+    for attempt in range(3):
+        await limiter.acquire()
+        try:
+            await bot.send_message(chat_id=user.user_id, text=text)
+            stats['sent'] += 1
+            return
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Forbidden:
+            # The user blocked the bot
+            break
+        except Exception as e:
+            print(e)
+            break
+    stats['failed'] += 1
+
+
+async def worker(bot, limiter, users, now, stats):
+    while True:
+        user = await users.get()
+        try:
+            if user is None:
+                return
+            await send_digest(bot, limiter, user, now, stats)
+        except Exception as e:
+            print(e)
+            stats['failed'] += 1
+        finally:
+            users.task_done()
+
+
+async def send_digests(hour):
+    """Sends the day's reminders to every user waking up on this UTC hour, with at most
+    concurrency messages in flight and no more than rate messages per second."""
+    start = time.monotonic()
+    now = datetime.datetime.utcnow()
+    stats = {'hour': hour, 'users': 0, 'sent': 0, 'empty': 0, 'failed': 0}
+    limiter = RateLimiter(rate)
+    # The bounded queue keeps the user scan only a little ahead of the senders
+    users = asyncio.Queue(maxsize=concurrency * 4)
+    await bot.initialize()
+    workers = [asyncio.create_task(worker(bot, limiter, users, now, stats)) for _ in range(concurrency)]
+    iterator = due_users(hour)
+    while True:
+        user = await run_sync(next, iterator, None)
+        if user is None:
+            break
+        stats['users'] += 1
+        await users.put(user)
+    for _ in workers:
+        await users.put(None)
+    await asyncio.gather(*workers)
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    stats['per_second'] = round(stats['sent'] / stats['seconds'], 2) if stats['seconds'] else 0
+    print(stats)
+    return stats
+
+
+def lambda_handler(event, context):
+    stats = run(send_digests(digest_hour(event)))
+    return {
+        'statusCode': 200,
+        'body': stats
+    }
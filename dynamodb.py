@@ -1,11 +1,73 @@
+import os
 import uuid
+import queue
+import datetime
+import threading
 import boto3
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
+from runtime import boto_config
 
-resource = boto3.resource('dynamodb')
+resource = boto3.resource('dynamodb', config=boto_config)
 user_table = resource.Table('users')
 reminder_table = resource.Table('reminders')
+history_table = resource.Table('reminderHistory')
+
+# DynamoDB deletes reminders once expiresAt, epoch seconds, has passed. It is set expiry_days
+# after the deadline (UTC midnight) so reminders outlast their day in every timezone.
+expiry_days = int(os.environ.get('REMINDER_EXPIRY_DAYS', 2))
+
+# Schema 2 reminders also carry sortDeadline, YYYY-MM-DD&<id>, which unlike uniqueDeadline sorts
+# by date. Both are written until every reminder has been migrated, and reads switch over to
+# deadlineIndex once REMINDER_READ_SCHEMA is set to 2.
+schema_version = 2
+read_schema_version = int(os.environ.get('REMINDER_READ_SCHEMA', 1))
+
+deadline_index = {
+    'IndexName': 'deadlineIndex',
+    'KeySchema': [
+        {
+            'AttributeName': 'userId',
+            'KeyType': 'HASH'
+        },
+        {
+            'AttributeName': 'sortDeadline',
+            'KeyType': 'RANGE'
+        }
+    ],
+    'Projection': {
+        'ProjectionType': 'ALL',
+    },
+    'ProvisionedThroughput': {
+        'ReadCapacityUnits': 2,
+        'WriteCapacityUnits': 2
+    }
+}
+
+# Timed reminders carry dueAt, their UTC due time as YYYY-MM-DDTHH:MM, and dueBucket, the hour
+# of dueAt plus a shard number, so that a busy hour doesn't land on a single dueIndex partition
+due_shards = 4
+
+due_index = {
+    'IndexName': 'dueIndex',
+    'KeySchema': [
+        {
+            'AttributeName': 'dueBucket',
+            'KeyType': 'HASH'
+        },
+        {
+            'AttributeName': 'dueAt',
+            'KeyType': 'RANGE'
+        }
+    ],
+    'Projection': {
+        'ProjectionType': 'ALL',
+    },
+    'ProvisionedThroughput': {
+        'ReadCapacityUnits': 1,
+        'WriteCapacityUnits': 1
+    }
+}
 
 
 def create_tables():
@@ -82,6 +144,18 @@ def create_tables():
                 {
                     'AttributeName': 'uniqueDeadline',
                     'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'sortDeadline',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'dueBucket',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'dueAt',
+                    'AttributeType': 'S'
                 }
             ],
             GlobalSecondaryIndexes=[
@@ -104,6 +178,48 @@ def create_tables():
                         'ReadCapacityUnits': 2,
                         'WriteCapacityUnits': 2
                     }
+                },
+                deadline_index,
+                due_index
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            },
+            # Expired reminders reach archive.py through the stream
+            StreamSpecification={
+                'StreamEnabled': True,
+                'StreamViewType': 'OLD_IMAGE'
+            }
+        )
+        reminder_table.wait_until_exists()
+        enable_expiry()
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceInUseException':
+            pass
+        else:
+            raise ClientError(e.response)
+    try:
+        resource.create_table(
+            TableName='reminderHistory',
+            KeySchema=[
+                {
+                    'AttributeName': 'userId',
+                    'KeyType': 'HASH'
+                },
+                {
+                    'AttributeName': 'sortDeadline',
+                    'KeyType': 'RANGE'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'userId',
+                    'AttributeType': 'N'
+                },
+                {
+                    'AttributeName': 'sortDeadline',
+                    'AttributeType': 'S'
                 }
             ],
             ProvisionedThroughput={
@@ -118,6 +234,16 @@ def create_tables():
             raise ClientError(e.response)
 
 
+def enable_expiry():
+    resource.meta.client.update_time_to_live(
+        TableName='reminders',
+        TimeToLiveSpecification={
+            'Enabled': True,
+            'AttributeName': 'expiresAt'
+        }
+    )
+
+
 def add_user(user_id):
     data = user_table.put_item(
         Item={
@@ -149,12 +275,27 @@ def update_user(user_id, remind_setting, timezone_offset, wake_time):
         Key={
             'userId': user_id
         },
-        ReturnValues='ALL_NEW',
     )
 
     return True
 
 
+def upsert_user(user_id, remind_setting, timezone_offset, wake_time):
+    """ creates or updates the user in a single write, without reading it first """
+    user_table.update_item(
+        Key={
+            'userId': user_id
+        },
+        UpdateExpression='SET remindSetting = :remind_setting, timezoneOffset = :timezone_offset, wakeTime = :wake_time',
+        ExpressionAttributeValues={
+            ':remind_setting': remind_setting,
+            ':timezone_offset': timezone_offset,
+            ':wake_time': wake_time
+        },
+    )
+    return True
+
+
 def query_user(user_id):
     data = user_table.get_item(
         Key={
@@ -167,35 +308,163 @@ def query_user(user_id):
         return None
 
 
+def projection(attributes):
+    """ ProjectionExpression arguments for attributes, which may include reserved words like text """
+    if not attributes:
+        return {}
+    names = {'#p{}'.format(i): attribute for i, attribute in enumerate(attributes)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def paginate(operation, **kwargs):
+    """ yields the items of a query or scan, following LastEvaluatedKey across pages """
+    while True:
+        data = operation(**kwargs)
+        yield from data['Items']
+        if 'LastEvaluatedKey' not in data:
+            return
+        kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+
+def parallel_scan(table, segments, **kwargs):
+    """ yields the items of a scan split into segments that are read concurrently """
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    done = object()
+
+    def scan_segment(segment):
+        try:
+            scan_kwargs = dict(kwargs, Segment=segment, TotalSegments=segments)
+            while not stop.is_set():
+                data = table.scan(**scan_kwargs)
+                pages.put(data['Items'])
+                if 'LastEvaluatedKey' not in data:
+                    break
+                scan_kwargs['ExclusiveStartKey'] = data['LastEvaluatedKey']
+            pages.put(done)
+        except Exception as e:
+            pages.put(e)
+
+    threads = [threading.Thread(target=scan_segment, args=(segment,), daemon=True)
+               for segment in range(segments)]
+    for thread in threads:
+        thread.start()
+    try:
+        remaining = segments
+        while remaining:
+            page = pages.get()
+            if page is done:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Unblock segments still waiting to hand over a page if the caller stopped early
+        stop.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def iter_users(wake_time=None, attributes=None, segments=1):
+    """ yields users, those with the given wake time if set, scanning segments in parallel otherwise """
+    kwargs = projection(attributes)
+    if wake_time is not None:
+        return paginate(user_table.query, IndexName='userIndex',
+                        KeyConditionExpression=Key('wakeTime').eq(wake_time), **kwargs)
+    if segments > 1:
+        return parallel_scan(user_table, segments, **kwargs)
+    return paginate(user_table.scan, **kwargs)
+
+
 def query_users(wake_time=None):
     """ query user tuple based on the user id """
-    if wake_time is not None:
-        data = user_table.query(
-            IndexName='userIndex', KeyConditionExpression=Key('wakeTime').eq(wake_time))
-    else:
-        data = user_table.scan()
+    return list(iter_users(wake_time))
 
-    return data['Items']
 
+def due_bucket(id, due_at):
+    """ dueIndex partition of a reminder due at the YYYY-MM-DDTHH:MM due_at """
+    return '{}#{}'.format(due_at[:13], uuid.UUID(id).int % due_shards)
 
-def add_reminder(user_id, text, deadline, time_by):
-    id = str(uuid.uuid1())
+
+def sort_deadline(deadline, id=None):
+    """ converts a dd#mm#YYYY deadline to the YYYY-MM-DD prefix of sortDeadline """
+    day, month, year = deadline.split('#')
+    deadline = '{}-{}-{}'.format(year, month, day)
+    if id:
+        return deadline + '&' + id
+    return deadline
+
+
+def expires_at(deadline):
+    """ expiresAt of a reminder on the dd#mm#YYYY deadline """
+    deadline = datetime.datetime.strptime(deadline, '%d#%m#%Y').replace(tzinfo=datetime.timezone.utc)
+    return int((deadline + datetime.timedelta(days=expiry_days)).timestamp())
+
+
+def reminder_item(id, user_id, text, deadline, time_by, due_at=None):
     item_dict = {
         'Id': id,
         'userId': user_id,
         'text': text,
         'uniqueDeadline': deadline + '&' + id,
-        'timeBy': time_by
+        'sortDeadline': sort_deadline(deadline, id),
+        'schemaVersion': schema_version,
+        'timeBy': time_by,
+        'expiresAt': expires_at(deadline)
     }
-    # if time_by:
-    #     item_dict['timeBy'] = time_by
+    if due_at:
+        item_dict['dueAt'] = due_at
+        item_dict['dueBucket'] = due_bucket(id, due_at)
+    return item_dict
+
+
+def add_reminder(user_id, text, deadline, time_by, due_at=None):
+    id = str(uuid.uuid1())
     reminder_table.put_item(
-        Item=item_dict
+        Item=reminder_item(id, user_id, text, deadline, time_by, due_at)
     )
     return id
 
 
-def update_reminder(id, text, deadline, time_by):
+def put_reminders(reminders):
+    """ writes reminders, dicts of reminder_item's arguments without an id for new ones, in
+    BatchWriteItem calls of 25 and returns their ids """
+    ids = list()
+    # batch_writer resends whatever comes back as UnprocessedItems
+    with reminder_table.batch_writer(overwrite_by_pkeys=['Id']) as batch:
+        for reminder in reminders:
+            reminder = dict(reminder)
+            reminder['id'] = reminder.get('id') or str(uuid.uuid1())
+            batch.put_item(Item=reminder_item(**reminder))
+            ids.append(reminder['id'])
+    return ids
+
+
+def update_reminder(id, text, deadline, time_by, due_at=None):
+    if due_at:
+        due_updates = {
+            'dueAt': {
+                'Value': due_at,
+                'Action': 'PUT'
+            },
+            'dueBucket': {
+                'Value': due_bucket(id, due_at),
+                'Action': 'PUT'
+            }
+        }
+    else:
+        due_updates = {
+            'dueAt': {
+                'Action': 'DELETE'
+            },
+            'dueBucket': {
+                'Action': 'DELETE'
+            }
+        }
     reminder_table.update_item(
         AttributeUpdates={
             'text': {
@@ -206,18 +475,51 @@ def update_reminder(id, text, deadline, time_by):
                 'Value': deadline + '&' + id,
                 'Action': 'PUT'
             },
+            'sortDeadline': {
+                'Value': sort_deadline(deadline, id),
+                'Action': 'PUT'
+            },
+            'schemaVersion': {
+                'Value': schema_version,
+                'Action': 'PUT'
+            },
             'timeBy': {
                 'Value': time_by,
                 'Action': 'PUT'
-            }
+            },
+            'expiresAt': {
+                'Value': expires_at(deadline),
+                'Action': 'PUT'
+            },
+            **due_updates
         },
         Key={
             'Id': id
         },
-        ReturnValues='ALL_NEW',
     )
 
 
+def mark_reminded(ids, slot):
+    """ records that the reminders were sent for the YYYY-MM-DDTHH:MM slot, so a retry of the
+    slot skips them """
+    for id in ids:
+        try:
+            reminder_table.update_item(
+                Key={
+                    'Id': id
+                },
+                UpdateExpression='SET remindedSlot = :slot',
+                ConditionExpression='attribute_exists(Id)',
+                ExpressionAttributeValues={
+                    ':slot': slot
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    return True
+
+
 def query_reminder(id):
     data = reminder_table.get_item(
         Key={
@@ -230,42 +532,67 @@ def query_reminder(id):
         return None
 
 
-def query_reminders(user_id, deadline=None):
+def iter_reminders(user_id, deadline=None, attributes=None):
+    """ yields the reminders of a user, those on the given dd#mm#YYYY deadline if set """
+    if read_schema_version >= 2:
+        index_name, sort_key = 'deadlineIndex', 'sortDeadline'
+        if deadline:
+            deadline = sort_deadline(deadline)
+    else:
+        index_name, sort_key = 'remindIndex', 'uniqueDeadline'
     if deadline:
-        data = reminder_table.query(
-            IndexName='remindIndex',
-            KeyConditionExpression=Key('userId').eq(
-                user_id) & Key('uniqueDeadline').begins_with(deadline)
-        )
+        key_condition = Key('userId').eq(user_id) & Key(sort_key).begins_with(deadline)
     else:
-        data = reminder_table.query(
-            IndexName='remindIndex',
-            KeyConditionExpression=Key('userId').eq(user_id)
-        )
+        key_condition = Key('userId').eq(user_id)
+    return paginate(reminder_table.query, IndexName=index_name,
+                    KeyConditionExpression=key_condition, **projection(attributes))
 
-    return data['Items']
+
+def query_reminders(user_id, deadline=None):
+    return list(iter_reminders(user_id, deadline))
+
+
+def iter_due_reminders(start, end=None, attributes=None):
+    """ yields the reminders due between the YYYY-MM-DDTHH:MM start and end, both inclusive """
+    end = end or start
+    hour = datetime.datetime.strptime(start[:13], '%Y-%m-%dT%H')
+    last_hour = datetime.datetime.strptime(end[:13], '%Y-%m-%dT%H')
+    while hour <= last_hour:
+        for shard in range(due_shards):
+            yield from paginate(reminder_table.query, IndexName='dueIndex',
+                                KeyConditionExpression=Key('dueBucket').eq('{}#{}'.format(hour.strftime('%Y-%m-%dT%H'), shard)) & Key('dueAt').between(start, end),
+                                **projection(attributes))
+        hour += datetime.timedelta(hours=1)
 
 
 def query_reminders_page(user_id, last_evaluated_key=None):
     """ query user tuple based on the user id """
+    if read_schema_version >= 2:
+        index_name, sort_key = 'deadlineIndex', 'sortDeadline'
+        if last_evaluated_key and '#' in last_evaluated_key:
+            # Page keys saved in user_data before the switch are uniqueDeadline values
+            deadline, id = last_evaluated_key.split('&')
+            last_evaluated_key = sort_deadline(deadline, id)
+    else:
+        index_name, sort_key = 'remindIndex', 'uniqueDeadline'
     if last_evaluated_key:
-        last_evaluated_key = {'uniqueDeadline': last_evaluated_key,
+        last_evaluated_key = {sort_key: last_evaluated_key,
                               'userId': user_id, 'Id': last_evaluated_key.split('&')[1]}
         data = reminder_table.query(
-            IndexName='remindIndex',
+            IndexName=index_name,
             Limit=11,
             ExclusiveStartKey=last_evaluated_key,
             KeyConditionExpression=Key('userId').eq(user_id)
         )
     else:
         data = reminder_table.query(
-            IndexName='remindIndex',
+            IndexName=index_name,
             Limit=11,
             KeyConditionExpression=Key('userId').eq(user_id)
         )
     reminders = data['Items']
     if len(reminders) == 11:
-        last_evaluated_key = reminders[9]['uniqueDeadline']
+        last_evaluated_key = reminders[9][sort_key]
         reminders.pop()
     else:
         last_evaluated_key = None
@@ -282,12 +609,10 @@ def delete_reminder(id):
     return True
 
 
-def delete_reminders(user_id, deadline):
-    data = reminder_table.query(IndexName='remindIndex', KeyConditionExpression=Key(
-        'userId').eq(user_id) & Key('uniqueDeadline').begins_with(deadline))['Items']
-    with reminder_table.batch_writer() as batch:
-        for item in data:
+def delete_reminders_by_id(ids):
+    with reminder_table.batch_writer(overwrite_by_pkeys=['Id']) as batch:
+        for id in ids:
             batch.delete_item(Key={
-                'Id': item['Id']
+                'Id': id
             })
     return True
@@ -1,11 +1,20 @@
-import nltk
-from nltk.tokenize import word_tokenize
-import nltk.tag
-from nltk import RegexpTagger
-import parsedatetime
+import os
+import re
+import json
+import pickle
+import hashlib
+import datetime
+import functools
+from collections import OrderedDict
 
-
-cal = parsedatetime.Calendar()
+# nltk and parsedatetime are imported when first needed, so that updates which never parse
+# text (callbacks, /settings) don't pay for them in the Lambda cold start.
+# If FILTER_SNAPSHOT points to a file written by save_snapshot(), the POS tagger is unpickled
+# from it instead of being loaded from NLTK_DATA.
+snapshot_path = os.environ.get('FILTER_SNAPSHOT')
+# 'nltk' chunks POS tagged text with the grammar below, 'rules' runs a token state machine over
+# the custom tags only and doesn't need nltk at all
+default_engine = os.environ.get('FILTER_ENGINE', 'nltk')
 
 patterns = {r'^(?:(?:31(\/|-|\.)(?:0?[13578]|1[02]))\1|(?:(?:29|30)(\/|-|\.)(?:0?[13-9]|1[0-2])\2))(?:(?:1[6-9]|[2-9]\d)?\d{2})$|^(?:29(\/|-|\.)0?2\3(?:(?:(?:1[6-9]|[2-9]\d)?(?:0[48]|[2468][048]|[13579][26])|(?:(?:16|[2468][048]|[3579][26])00))))$|^(?:0?[1-9]|1\d|2[0-8])(\/|-|\.)(?:(?:0?[1-9])|(?:1[0-2]))\4(?:(?:1[6-9]|[2-9]\d)?\d{2})$': 'DATE_DMY',
             r'^(?:(?:31(\/|-|\.)(?:0?[13578]|1[02]))\1|(?:(?:29|30)(\/|-|\.)(?:0?[13-9]|1[0-2])\2))(?:(?:1[6-9]|[2-9]\d)?\d{2})$|^(?:29(\/|-|\.)0?2\3(?:(?:(?:1[6-9]|[2-9]\d)?(?:0[48]|[2468][048]|[13579][26])|(?:(?:16|[2468][048]|[3579][26])00))))$|^(?:0?[1-9]|1\d|2[0-8])(\/|-|\.)(?:(?:0?[1-9])|(?:1[0-2]))$': 'DATE_DM',
@@ -16,7 +25,63 @@ patterns = {r'^(?:(?:31(\/|-|\.)(?:0?[13578]|1[02]))\1|(?:(?:29|30)(\/|-|\.)(?:0
             r'^([01][0-9]|2[0-3])(?:\.|:)?([0-5][0-9])$': 'TIME_24',
             r'^(1[0-2]|0?[1-9])(?:\.|:)?(?:[0-5][0-9])?(am|pm|Am|Pm|AM|PM)$': 'TIME_12'
             }
-reg_tagger = RegexpTagger(list(patterns.items()))
+custom_tags = frozenset(patterns.values())
+
+# Every rule of the grammar needs one of these, without them no date can be matched
+date_tags = frozenset(('DAY', 'MONTH', 'DATE_DMY', 'DATE_DM'))
+
+# Cheap screen run before any NLTK work. Every token tagged DAY, MONTH or DATE_* starts with one
+# of these words (at a word boundary) or contains a digit, separator, digit sequence, so text
+# without a match can't contain a date. It may let through text that has none (e.g. "money").
+date_prefilter = re.compile(
+    r'\b(?:today|tomorrow|tmr|mon|tue|wed|thu|fri|sat|sun|jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)|\d[/.\-]\d',
+    re.IGNORECASE)
+
+
+def compile_token_classifier(patterns):
+    """Compiles patterns into one regex of named alternatives, tried in order like a RegexpTagger.
+
+    Each pattern is wrapped in a group named after its position, which shifts the numbers of the
+    groups inside it, so its backreferences are renumbered to match."""
+    alternatives = list()
+    tags = dict()
+    groups = 0
+    for i, (pattern, tag) in enumerate(patterns.items()):
+        name = 't{}'.format(i)
+        offset = groups + 1
+        groups = offset + re.compile(pattern).groups
+        pattern = re.sub(r'\\(\d+)', lambda m: '\\' + str(int(m.group(1)) + offset), pattern)
+        alternatives.append('(?P<{}>{})'.format(name, pattern))
+        tags[name] = tag
+    return re.compile('|'.join(alternatives)), tags
+
+
+token_classifier, classifier_tags = compile_token_classifier(patterns)
+
+
+def reg_tag(tokens):
+    """Tags every token with the tag of the first pattern matching it, or None."""
+    tagged = list()
+    for token in tokens:
+        m = token_classifier.match(token)
+        tagged.append((token, classifier_tags[m.lastgroup] if m else None))
+    return tagged
+
+
+# The DAY and DAY_ADJ patterns are only anchored at the start of the token, so they also match
+# words like "friend", "money", "sunshine" or "nextdoor"
+closed_tags = {
+    'DAY': frozenset(('today', 'tomorrow', 'tmr', 'mon', 'monday', 'tue', 'tues', 'tuesday', 'wed', 'wednesday',
+                      'thu', 'thur', 'thurs', 'thursday', 'fri', 'friday', 'sat', 'saturday', 'sun', 'sunday')),
+    'DAY_ADJ': frozenset(('this', 'next', 'following')),
+}
+
+
+def date_tag(tokens):
+    """reg_tag, keeping DAY and DAY_ADJ only for the words they are meant for."""
+    return [(token, None if tag in closed_tags and token.lower() not in closed_tags[tag] else tag)
+            for token, tag in reg_tag(tokens)]
+
 
 grammar = r"""
     MATCH_DAY:
@@ -51,13 +116,57 @@ grammar = r"""
     <IN><NN.*>*{<IN>?<TIME.*><IN>?<DAY_ADJ>?<DAY>}
     <IN><TO><VB.*>{<IN>?<TIME.*><IN>?<DAY_ADJ>?<DAY>}
     """
-chunk_parser = nltk.RegexpParser(grammar)
+
+
+@functools.lru_cache(maxsize=None)
+def load_snapshot():
+    if snapshot_path and os.path.exists(snapshot_path):
+        with open(snapshot_path, 'rb') as f:
+            return pickle.load(f)
+    return dict()
+
+
+@functools.lru_cache(maxsize=None)
+def get_calendar():
+    import parsedatetime
+    return parsedatetime.Calendar()
+
+
+@functools.lru_cache(maxsize=None)
+def get_chunk_parser():
+    # Built from the grammar even with a snapshot: it only takes a few ms, and since nltk wraps
+    # its regexes with a timeout the parser no longer works once unpickled
+    import nltk
+    return nltk.RegexpParser(grammar)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pos_tagger():
+    if 'pos_tagger' in load_snapshot():
+        return load_snapshot()['pos_tagger']
+    from nltk.tag.perceptron import PerceptronTagger
+    return PerceptronTagger()
+
+
+def save_snapshot(path):
+    """Pickles the POS tagger to path, to be used through FILTER_SNAPSHOT."""
+    with open(path, 'wb') as f:
+        pickle.dump({'pos_tagger': get_pos_tagger()}, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 def tokenize(sent):
-    reg_out = reg_tagger.tag(word_tokenize(sent))
-    tag_out = nltk.pos_tag(word_tokenize(sent))
-    return [(token, rtag) if rtag in patterns.values() else (token, ttag) for (token, rtag), (_, ttag) in zip(reg_out, tag_out)]
+    from nltk.tokenize import word_tokenize
+    tokens = word_tokenize(sent)
+    return tag_tokens(tokens, date_tag(tokens))
+
+
+def tag_tokens(tokens, reg_out):
+    """POS tags tokens, keeping the custom tags of reg_out where there is one."""
+    return merge_tags(reg_out, get_pos_tagger().tag(tokens))
+
+
+def merge_tags(reg_out, tag_out):
+    return [(token, rtag) if rtag in custom_tags else (token, ttag) for (token, rtag), (_, ttag) in zip(reg_out, tag_out)]
 
 
 statements_1 = ["buy hamster by 16 march",
@@ -80,10 +189,10 @@ statements_2 = ["buy hamster by tomorrow 1830",
                 "Tmr 0800 bring a set of lightsticks"]
 
 
-def gen_readable_str(a, time=None):
+def gen_readable_str(leaves, time=None):
     dumb_str = str()
     date_str = str()
-    for lf in a.leaves():
+    for lf in leaves:
         pos = lf[1]
         val = lf[0].lower()
 
@@ -119,26 +228,264 @@ def gen_readable_str(a, time=None):
     return dumb_str
 
 
-def match_date(statement):
-    tokenized_statement = tokenize(statement)
-    tree = chunk_parser.parse(tokenized_statement)
+# Part of the Redis keys. Bump it whenever a parser change alters results, so that other
+# containers stop serving what was cached before the change.
+cache_version = 2
+
+
+class MatchDateCache(object):
+    """Bounded LRU cache of match_date results, keyed on the normalized statement and the
+    reference date that relative words like "tmr" resolve against.
+
+    If redis_conn is set, misses are looked up in and results written to Redis as well, so
+    Lambda containers share what they have parsed."""
+
+    def __init__(self, maxsize=1024, redis_conn=None, ttl=86400):
+        self.maxsize = maxsize
+        self.redis_conn = redis_conn
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def key(self, statement, reference_date, engine):
+        return (' '.join(statement.split()), reference_date, engine)
+
+    def redis_key(self, key):
+        statement, reference_date, engine = key
+        return 'match_date:v{}:{}:{}:{}'.format(cache_version, engine, reference_date.isoformat(),
+                                                 hashlib.sha1(statement.encode()).hexdigest())
+
+    def get(self, key):
+        """Returns (found, result)."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+        if self.redis_conn is not None:
+            try:
+                data = self.redis_conn.get(self.redis_key(key))
+            except Exception:
+                data = None
+            if data is not None:
+                result = decode_result(json.loads(data))
+                self.redis_hits += 1
+                self.put(key, result, shared=False)
+                return True, result
+        self.misses += 1
+        return False, None
+
+    def put(self, key, result, shared=True):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        if shared and self.redis_conn is not None:
+            try:
+                self.redis_conn.set(self.redis_key(key), json.dumps(encode_result(result)), ex=self.ttl)
+            except Exception:
+                pass
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.redis_hits = self.misses = 0
+
+
+def encode_result(result):
+    if result is None:
+        return None
+    return {'deadline': result['deadline'].isoformat(),
+            'time_by': result['time_by'].strftime('%H:%M') if result['time_by'] else None,
+            'text': result['text']}
+
+
+def decode_result(data):
+    if data is None:
+        return None
+    return {'deadline': datetime.date.fromisoformat(data['deadline']),
+            'time_by': datetime.datetime.strptime(data['time_by'], '%H:%M').time() if data['time_by'] else None,
+            'text': data['text']}
+
+
+match_date_cache = MatchDateCache()
+
+
+def match_date(statement, reference_date=None, engine=None):
+    """Returns the deadline, time_by and remaining text of statement, or None if it has no date.
+
+    Relative dates resolve against reference_date, today by default. engine is 'nltk' or
+    'rules', default_engine by default."""
+    if not date_prefilter.search(statement):
+        return None
+    if reference_date is None:
+        reference_date = datetime.date.today()
+    engine = engine or default_engine
+    key = match_date_cache.key(statement, reference_date, engine)
+    found, result = match_date_cache.get(key)
+    if not found:
+        result = engines[engine](statement, reference_date)
+        match_date_cache.put(key, result)
+    return dict(result) if result else None
 
+
+def match_dates(statements, reference_date=None, engine=None):
+    """match_date for a list of statements, e.g. lines pasted for a bulk import.
+
+    With the nltk engine, the statements that get past the prefilter and the cache are POS
+    tagged in one batch and resolved against the same reference date."""
+    if reference_date is None:
+        reference_date = datetime.date.today()
+    engine = engine or default_engine
+    if engine != 'nltk':
+        return [match_date(statement, reference_date, engine) for statement in statements]
+
+    from nltk.tokenize import word_tokenize
+    results = [None] * len(statements)
+    pending = list()
+    for i, statement in enumerate(statements):
+        if not date_prefilter.search(statement):
+            continue
+        key = match_date_cache.key(statement, reference_date, engine)
+        found, result = match_date_cache.get(key)
+        if found:
+            results[i] = dict(result) if result else None
+            continue
+        tokens = word_tokenize(statement)
+        reg_out = date_tag(tokens)
+        if not any(rtag in date_tags for _, rtag in reg_out):
+            match_date_cache.put(key, None)
+            continue
+        pending.append((i, key, tokens, reg_out))
+
+    if pending:
+        tag_outs = get_pos_tagger().tag_sents([tokens for _, _, tokens, _ in pending])
+        chunk_parser = get_chunk_parser()
+        for (i, key, _, reg_out), tag_out in zip(pending, tag_outs):
+            result = resolve_tree(chunk_parser.parse(merge_tags(reg_out, tag_out)), reference_date)
+            match_date_cache.put(key, result)
+            results[i] = dict(result) if result else None
+    return results
+
+
+def parse_date(statement, reference_date):
+    from nltk.tokenize import word_tokenize
+    tokens = word_tokenize(statement)
+    reg_out = date_tag(tokens)
+    # The POS tags can't make up for a missing date, so don't compute them
+    if not any(rtag in date_tags for _, rtag in reg_out):
+        return None
+    tokenized_statement = tag_tokens(tokens, reg_out)
+    return resolve_tree(get_chunk_parser().parse(tokenized_statement), reference_date)
+
+
+weekdays = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+months = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+
+
+def resolve_day(val, day_adj, reference_date):
+    if val.startswith('tod'):
+        return reference_date
+    if val.startswith(('tom', 'tmr')):
+        return reference_date + datetime.timedelta(days=1)
+    weekday = weekdays.index(val[:3])
+    today = reference_date.weekday()
+    if day_adj == 'this':
+        # The coming one, today included
+        days = (weekday - today) % 7
+    elif day_adj == 'next':
+        # The one in next week, like parsedatetime
+        days = weekday - today + 7
+    else:
+        # Bare and "following" weekdays are the next one after today, like parsedatetime
+        days = weekday - today if weekday > today else weekday - today + 7
+    return reference_date + datetime.timedelta(days=days)
+
+
+def resolve_day_month(day, month, year, reference_date):
+    if year is None:
+        year = reference_date.year
+        # Like parsedatetime, a day that has passed this year is next year's
+        if (month, day) < (reference_date.month, reference_date.day):
+            year += 1
+    elif year < 100:
+        year += 2000
+    return datetime.date(year, month, day)
+
+
+def resolve_time(val, pos):
+    digits = re.sub(r'[^0-9]', '', val)
+    if pos == 'TIME_12' and len(digits) <= 2:
+        hour, minute = int(digits), 0
+    else:
+        hour, minute = int(digits[:-2]), int(digits[-2:])
+    if pos == 'TIME_12':
+        hour = hour % 12 + (12 if val.endswith('pm') else 0)
+    return datetime.time(hour, minute)
+
+
+def resolve_direct(leaves, reference_date):
+    """Maps the tagged leaves of a date expression straight to a date and time, or raises
+    ValueError for what it doesn't understand."""
+    date = None
+    time = None
+    day_adj = None
+    month = None
+    numbers = list()
+    for token, pos in leaves:
+        val = token.lower()
+        if pos == 'DAY':
+            date = resolve_day(val, day_adj, reference_date)
+        elif pos == 'DAY_ADJ':
+            day_adj = val
+        elif pos in ('TIME_24', 'TIME_12'):
+            time = resolve_time(val, pos)
+        elif pos in ('DATE_DMY', 'DATE_DM'):
+            parts = [int(part) for part in re.split(r'[/.\-]', val)]
+            date = resolve_day_month(parts[0], parts[1], parts[2] if len(parts) > 2 else None, reference_date)
+        elif pos == 'MONTH':
+            month = months.index(val[:3]) + 1
+        elif pos == 'CD':
+            numbers.append(int(re.match(r'\d+', val).group()))
+    if month is not None:
+        days = [number for number in numbers if number <= 31]
+        years = [number for number in numbers if number > 31]
+        if not days:
+            raise ValueError("No day for the month")
+        date = resolve_day_month(days[0], month, years[0] if years else None, reference_date)
+    if date is None:
+        raise ValueError("No date")
+    return date, time
+
+
+def resolve_leaves(leaves, reference_date, time=False):
+    """Returns the date and, if time, the time of a date expression, resolved against
+    reference_date. Falls back to parsedatetime for anything resolve_direct doesn't understand."""
+    try:
+        date, time_by = resolve_direct(leaves, reference_date)
+        if not time or time_by is not None:
+            return date, time_by if time else None
+    except (ValueError, AttributeError):
+        pass
+    source_time = datetime.datetime.combine(reference_date, datetime.time())
+    date_time, _ = get_calendar().parseDT(
+        datetimeString=gen_readable_str(leaves, time), sourceTime=source_time)
+    return date_time.date(), date_time.time() if time else None
+
+
+def resolve_tree(tree, reference_date):
+    from nltk.tree import Tree
     date = None
     time = None
     text = str()
 
     for a in tree:
-        if isinstance(a, nltk.tree.Tree):
+        if isinstance(a, Tree):
             label = a.label()
             if label in ("MATCH_DATE_TIME", "MATCH_DAY_TIME"):
-                date_time, _ = cal.parseDT(
-                    datetimeString=gen_readable_str(a, True))
-                date = date_time.date()
-                time = date_time.time()
+                date, time = resolve_leaves(a.leaves(), reference_date, True)
             elif label in ("MATCH_DAY", "MATCH_DATE"):
-                date_time, _ = cal.parseDT(
-                    datetimeString=gen_readable_str(a))
-                date = date_time.date()
+                date, _ = resolve_leaves(a.leaves(), reference_date)
             else:
                 pass
         else:
@@ -150,3 +497,100 @@ def match_date(statement):
         return {'deadline': date, 'time_by': time, 'text': text}
     else:
         return None
+
+
+# Words the rules engine treats like the IN tag of the grammar
+prepositions = frozenset(('on', 'by', 'at', 'in', 'of', 'before', 'until', 'till', 'for', 'from', 'after'))
+# Keeps dates, times and contractions like 16/03/2022, 3:30pm or don't in one token
+simple_token = re.compile(r"\w+(?:[:./\-']\w+)*|[^\w\s]")
+cardinal = re.compile(r'^\d{1,4}(?:st|nd|rd|th)?$', re.IGNORECASE)
+
+
+def rules_tag(statement):
+    """Tags the tokens of statement with the custom tags, IN and CD, without nltk."""
+    tagged = list()
+    for token, tag in date_tag(simple_token.findall(statement)):
+        if tag is None:
+            if token.lower() in prepositions:
+                tag = 'IN'
+            elif cardinal.match(token):
+                tag = 'CD'
+        tagged.append((token, tag))
+    return tagged
+
+
+def date_core_end(tags, i):
+    """Returns the end of the day or date expression starting at i, or None."""
+    n = len(tags)
+
+    def tag(j):
+        return tags[j] if j < n else None
+
+    if tag(i) == 'DAY_ADJ' and tag(i + 1) == 'DAY':
+        return i + 2
+    if tag(i) in ('DAY', 'DATE_DMY', 'DATE_DM'):
+        return i + 1
+    if tag(i) == 'CD':
+        j = i + 1
+        if tag(j) == 'IN' and tag(j + 1) == 'MONTH':
+            j += 1
+        if tag(j) == 'MONTH':
+            return j + 2 if tag(j + 1) == 'CD' else j + 1
+    if tag(i) == 'MONTH' and tag(i + 1) == 'CD':
+        return i + 2
+    return None
+
+
+def parse_date_rules(statement, reference_date):
+    """Grammar-free engine: finds day/date expressions, with a preposition before them and a time
+    next to them, in one left to right pass over the custom tags."""
+    tagged = rules_tag(statement)
+    if not any(tag in date_tags for _, tag in tagged):
+        return None
+    tags = [tag for _, tag in tagged]
+    n = len(tags)
+
+    def is_time(j):
+        return 0 <= j < n and tags[j] is not None and tags[j].startswith('TIME')
+
+    chunks = list()
+    i = 0
+    while i < n:
+        end = date_core_end(tags, i)
+        if end is None:
+            i += 1
+            continue
+        start = i
+        has_time = False
+        # A time after the date ("tmr 1830", "monday at 7am") or else before it ("3pm on monday")
+        if is_time(end):
+            end, has_time = end + 1, True
+        elif end < n and tags[end] == 'IN' and is_time(end + 1):
+            end, has_time = end + 2, True
+        lower = chunks[-1][1] if chunks else 0
+        if start - 1 >= lower and tags[start - 1] == 'IN':
+            start -= 1
+        if not has_time:
+            if is_time(start - 1) and start - 1 >= lower:
+                start, has_time = start - 1, True
+            elif start - 2 >= lower and tags[start - 1] == 'IN' and is_time(start - 2):
+                start, has_time = start - 2, True
+        if has_time and start - 1 >= lower and tags[start - 1] == 'IN':
+            start -= 1
+        chunks.append((start, end, has_time))
+        i = end
+
+    date = None
+    time = None
+    for start, end, has_time in chunks:
+        date, time = resolve_leaves(tagged[start:end], reference_date, has_time)
+
+    in_chunk = set(j for start, end, _ in chunks for j in range(start, end))
+    text = ' '.join(token for j, (token, _) in enumerate(tagged) if j not in in_chunk)
+    if date:
+        return {'deadline': date, 'time_by': time, 'text': text}
+    else:
+        return None
+
+
+engines = {'nltk': parse_date, 'rules': parse_date_rules}
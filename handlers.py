@@ -1,7 +1,7 @@
 import os
 import json
-import uuid
 import boto3
+import asyncio
 import datetime
 from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, constants
 from telegram.ext import (
@@ -9,11 +9,13 @@ from telegram.ext import (
     ConversationHandler,
 )
 from classes import UserObject, ReminderObject
-from filter import match_date
+from async_dynamodb import run_sync
+from runtime import boto_config
+from filter import match_date, match_dates
 
 # Stages + Callback data
-USER_ROUTE, REMINDER_ROUTE, EDIT_REMINDER_ROUTE, SETTINGS_ROUTE, TYPE_SETTINGS_ROUTE = range(
-    5)
+USER_ROUTE, REMINDER_ROUTE, EDIT_REMINDER_ROUTE, SETTINGS_ROUTE, TYPE_SETTINGS_ROUTE, IMPORT_ROUTE = range(
+    6)
 OPTION_0, OPTION_1, OPTION_2, OPTION_3, VIEW_REMINDERS, VIEW_REMINDER, EDIT_SETTINGS, BACK = range(
     8)
 
@@ -73,35 +75,48 @@ invalid_deadline_keyboard = [
 
 invalid_deadline_markup = InlineKeyboardMarkup(invalid_deadline_keyboard)
 
-scheduler_client = boto3.client('scheduler')
-
-
-def put_event(time, detail):
-    response = scheduler_client.create_schedule(
-        Description='AnelaBot remind once scheduler',
-        FlexibleTimeWindow={
-            'Mode': 'OFF'
-        },
-        GroupName='AnelaBotSchedulegroup',
-        Name='Scheduled' + detail['reminder_id'] + detail['token'],
-        ScheduleExpression='at(' + time.strftime('%Y-%m-%dT%H:%M:%S)'),
-        ScheduleExpressionTimezone='UTC',
-        State='ENABLED',
-        Target={
-            'Arn': os.environ.get('AnelaBotHandlerARN'),
-            # 'EventBridgeParameters': {
-            #     'DetailType': 'Custom AnelaBot detail',
-            #     'Source': 'anelabot.lambda.main',
-            # },
-            'Input': json.dumps(detail),
-            'RetryPolicy': {
-                'MaximumEventAgeInSeconds': 60,
-                'MaximumRetryAttempts': 3
+scheduler_client = boto3.client('scheduler', config=boto_config)
+
+
+# Slots this container has already scheduled, to skip repeat create_schedule calls
+scheduled_slots = set()
+
+
+def schedule_slot(due_at):
+    """Makes sure the handler runs at due_at to send every reminder due that minute.
+
+    There is one schedule per minute rather than per reminder. The reminders themselves are
+    looked up through dueIndex when it fires, so editing or deleting a reminder needs no
+    Scheduler call."""
+    slot = due_at.strftime('%Y%m%d%H%M')
+    if slot in scheduled_slots:
+        return
+    try:
+        scheduler_client.create_schedule(
+            ActionAfterCompletion='DELETE',
+            Description='AnelaBot reminder slot scheduler',
+            FlexibleTimeWindow={
+                'Mode': 'OFF'
             },
-            'RoleArn': os.environ.get('AnelaBotSchedulerARN'),
-        }
-    )
-    return response
+            GroupName='AnelaBotSchedulegroup',
+            Name='AnelaBotSlot' + slot,
+            ScheduleExpression='at(' + due_at.strftime('%Y-%m-%dT%H:%M:00)'),
+            ScheduleExpressionTimezone='UTC',
+            State='ENABLED',
+            Target={
+                'Arn': os.environ.get('AnelaBotHandlerARN'),
+                'Input': json.dumps({"action": "remind_slot", "slot": due_at.strftime('%Y-%m-%dT%H:%M')}),
+                'RetryPolicy': {
+                    'MaximumEventAgeInSeconds': 60,
+                    'MaximumRetryAttempts': 3
+                },
+                'RoleArn': os.environ.get('AnelaBotSchedulerARN'),
+            }
+        )
+    except scheduler_client.exceptions.ConflictException:
+        # Another reminder already scheduled this slot
+        pass
+    scheduled_slots.add(slot)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -110,18 +125,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_name = update.message.from_user.first_name
     user_id = update.message.chat_id
 
-    user = UserObject.get_user(user_id)
+    user = await run_sync(UserObject.get_user, user_id)
 
     if user:
         await update.message.reply_text("Welcome back {username}!".format(username=user_name))
     else:
         user = UserObject(user_id=user_id)
 
-        if not user.save():
+        if not await run_sync(user.save):
             await update.message.reply_text(text="Sorry, an unexpected error occured. Please contact admin")
             return ConversationHandler.END
 
-        start_message = await update.message.reply_text("Welcome to AnelaBot!!\n\n<b>Purpose:</b>\n - I am a reminder bot that allows you to create reminders through natural language processing (NLP).\n - If there are reminders set for a day, I will send a message to remind you on the morning of the day itself.\n - I ignore all messages not intended to be a reminder.\n - I intend to be a upgrade to the practice of 'Chat with myself' i.e. sending messages to yourself for future reference. You can sent messages to me, which I will ignore unless the syntax of a reminder is detected.\n\n<b>How to use:</b>\n - In /settings, you can set your timezone and preferred 'wake up time', the time when daily updates will be sent.\n - In /view_reminders, you can view all your reminders (sorted by deadline), and edit them.\n - You can create reminders by typing one, following the reminder syntax. E.g. try this: start studying today 3pm \n - You can send text for future references like links, strings etc., which I will ignore.\n\n<b>Reminder syntax:</b>\n - Bring keycard today/tomorrow/tmr/next day/following day\n - Develop code this wed/on wednesday\n - Play frisbee next/following sunday\n - Scholarship interview on 27 feb 2022\n - Christmas party on 25 dec(ember)\n\n<b>Privacy:</b> I only save information from messages deemed as reminders, to remind you.\n\n<b>p.s.:</b> This deployment is hosted with free-tier AWS services which may take ~3s between cold starts as well as delays up to 1min in reminders.", parse_mode=constants.ParseMode.HTML)
+        start_message = await update.message.reply_text("Welcome to AnelaBot!!\n\n<b>Purpose:</b>\n - I am a reminder bot that allows you to create reminders through natural language processing (NLP).\n - If there are reminders set for a day, I will send a message to remind you on the morning of the day itself.\n - I ignore all messages not intended to be a reminder.\n - I intend to be a upgrade to the practice of 'Chat with myself' i.e. sending messages to yourself for future reference. You can sent messages to me, which I will ignore unless the syntax of a reminder is detected.\n\n<b>How to use:</b>\n - In /settings, you can set your timezone and preferred 'wake up time', the time when daily updates will be sent.\n - In /view_reminders, you can view all your reminders (sorted by deadline), and edit them.\n - In /import, you can paste or forward many notes at once, one reminder per line. I'll create a reminder for every line with a date in the future, send /done when you're finished.\n - You can create reminders by typing one, following the reminder syntax. E.g. try this: start studying today 3pm \n - You can send text for future references like links, strings etc., which I will ignore.\n\n<b>Reminder syntax:</b>\n - Bring keycard today/tomorrow/tmr/next day/following day\n - Develop code this wed/on wednesday\n - Play frisbee next/following sunday\n - Scholarship interview on 27 feb 2022\n - Christmas party on 25 dec(ember)\n\n<b>Privacy:</b> I only save information from messages deemed as reminders, to remind you.\n\n<b>p.s.:</b> This deployment is hosted with free-tier AWS services which may take ~3s between cold starts as well as delays up to 1min in reminders.", parse_mode=constants.ParseMode.HTML)
         await context.bot.pin_chat_message(chat_id=user_id, message_id=start_message.message_id)
     return USER_ROUTE
 
@@ -135,7 +150,7 @@ async def back(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
 async def settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """Creates ReplyKeyboard for userType, redirect ROUTES"""
     user_id = update.effective_chat.id
-    user = UserObject.get_user(user_id)
+    user = await run_sync(UserObject.get_user, user_id)
     query = update.callback_query
 
     settings_keyboard = [
@@ -174,11 +189,11 @@ async def choose_remind_setting(update: Update, context: ContextTypes.DEFAULT_TY
 async def edit_remind_setting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """Creates ReplyKeyboard for userType, redirect ROUTES"""
     user_id = update.effective_chat.id
-    user = UserObject.get_user(user_id)
+    user = await run_sync(UserObject.get_user, user_id)
 
     query = update.callback_query
     user.remind_setting = int(query.data[2:])
-    user.save()
+    await run_sync(user.save)
 
     return await settings_menu(update, context)
 
@@ -205,9 +220,9 @@ async def edit_timezone_setting(update: Update, context: ContextTypes.DEFAULT_TY
             offset = None
     if offset:
         user_id = update.effective_chat.id
-        user = UserObject.get_user(user_id)
+        user = await run_sync(UserObject.get_user, user_id)
         user.timezone_offset = offset
-        user.save()
+        await run_sync(user.save)
         await context.bot.send_message(chat_id=user_id, text="You have selected {}.00 UTC as your timezone!".format(offset), reply_markup=ReplyKeyboardRemove())
         return await settings_menu(update, context)
     else:
@@ -230,9 +245,9 @@ async def edit_wake_setting(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_chat.id
     wake_time = int(query.data[2:])
 
-    user = UserObject.get_user(user_id)
+    user = await run_sync(UserObject.get_user, user_id)
     user.wake_time = wake_time - user.timezone_offset
-    user.save()
+    await run_sync(user.save)
 
     return await settings_menu(update, context)
 
@@ -252,7 +267,6 @@ async def view_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         except ValueError:
             page_number = 0
     else:
-        await update.message.delete()
         page_number = 0
 
     if page_number:
@@ -260,7 +274,12 @@ async def view_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     else:
         exclusive_start_key = None
 
-    data = ReminderObject.reminders_by_page(user_id, exclusive_start_key)
+    if query:
+        data = await run_sync(ReminderObject.reminders_by_page, user_id, exclusive_start_key)
+    else:
+        # Delete the command while the page is fetched
+        _, data = await asyncio.gather(update.message.delete(), run_sync(
+            ReminderObject.reminders_by_page, user_id, exclusive_start_key))
     last_evaluated_key = data['last_evaluated_key']
 
     for i in data['reminders']:
@@ -311,7 +330,7 @@ async def view_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> s
     query = update.callback_query
     reminder_id = query.data[2:]
 
-    reminder = ReminderObject.get_reminder(reminder_id)
+    reminder = await run_sync(ReminderObject.get_reminder, reminder_id)
 
     if query.message:
         keyboard = [
@@ -363,8 +382,8 @@ async def delete_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     reminder_id = query.data[2:]
 
-    reminder = ReminderObject.get_reminder(reminder_id)
-    reminder.delete()
+    reminder = await run_sync(ReminderObject.get_reminder, reminder_id)
+    await run_sync(reminder.delete)
 
     update.callback_query.data = str(VIEW_REMINDER)
 
@@ -373,49 +392,35 @@ async def delete_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def edit_reminder_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     user_id = update.effective_chat.id
-    user = UserObject.get_user(user_id)
+    user = await run_sync(UserObject.get_user, user_id)
     reminder_id = context.user_data['reminder_id']
     context.user_data.clear()
     text = update.message.text
 
-    data = match_date(text)
+    now = datetime.datetime.utcnow()
+    local_now = now + datetime.timedelta(hours=user.timezone_offset)
+    data = match_date(text, reference_date=local_now.date())
 
     if data:
         time_by = data['time_by']
         deadline = data['deadline']
 
-        now = datetime.datetime.utcnow()
-        local_now = now + datetime.timedelta(hours=user.timezone_offset)
-        if local_now.date() > now.date():
-            new_date = deadline + datetime.timedelta(days=1)
-            if new_date <= local_now.date() + datetime.timedelta(days=1):
-                deadline = new_date
-        elif local_now.date() < now.date():
-            new_date = deadline - datetime.timedelta(days=1)
-            if new_date <= local_now.date() + datetime.timedelta(days=1):
-                deadline = new_date
-
         if time_by:
             time = datetime.datetime.combine(
                 deadline, time_by) - datetime.timedelta(hours=user.timezone_offset)
             if time < now:
                 await context.bot.send_message(chat_id=user_id, text="Sorry, your deadline is in the past! I'm not a time machine...", reply_markup=invalid_deadline_markup)
                 return REMINDER_ROUTE
-            detail = {"action": "remind_once",
-                      "reminder_id": reminder_id,
-                      "text": data['text'],
-                      "chat_id": user_id,
-                      "time_by": time_by.strftime("%H%M"),
-                      "token": str(uuid.uuid4())[:8]
-                      }
-            put_event(time=time, detail=detail)
         else:
+            time = None
             if deadline <= local_now.date():
                 await context.bot.send_message(chat_id=user_id, text="Sorry, for reminders without time specified, do set them from tomorrow onwards! If you wanna set a reminder for today, please specify a time for me to remind you on!!", reply_markup=invalid_deadline_markup)
                 return REMINDER_ROUTE
 
-        ReminderObject(id=reminder_id, user_id=user_id,
-                       text=data['text'], deadline=deadline, time_by=time_by).save()
+        await run_sync(ReminderObject(id=reminder_id, user_id=user_id,
+                       text=data['text'], deadline=deadline, time_by=time_by, due_at=time).save)
+        if time:
+            await run_sync(schedule_slot, time)
 
         update.callback_query = CallbackQuery(
             id=None, from_user=None, chat_instance=None, data=str(VIEW_REMINDER) + '#' + str(reminder_id))
@@ -424,25 +429,16 @@ async def edit_reminder_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def create_reminder_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     user_id = update.effective_chat.id
-    user = UserObject.get_user(user_id)
+    user = await run_sync(UserObject.get_user, user_id)
     text = update.message.text
-    data = match_date(text)
+    now = datetime.datetime.utcnow()
+    local_now = now + datetime.timedelta(hours=user.timezone_offset)
+    data = match_date(text, reference_date=local_now.date())
 
     if data:
         time_by = data['time_by']
         deadline = data['deadline']
 
-        now = datetime.datetime.utcnow()
-        local_now = now + datetime.timedelta(hours=user.timezone_offset)
-        if local_now.date() > now.date():
-            new_date = deadline + datetime.timedelta(days=1)
-            if new_date <= local_now.date() + datetime.timedelta(days=1):
-                deadline = new_date
-        elif local_now.date() < now.date():
-            new_date = deadline - datetime.timedelta(days=1)
-            if new_date <= local_now.date() + datetime.timedelta(days=1):
-                deadline = new_date
-
         if time_by:
             time = datetime.datetime.combine(
                 deadline, time_by) - datetime.timedelta(hours=user.timezone_offset)
@@ -450,34 +446,82 @@ async def create_reminder_text(update: Update, context: ContextTypes.DEFAULT_TYP
                 await context.bot.send_message(chat_id=user_id, text="Sorry, your deadline is in the past! I'm not a time machine...", reply_markup=invalid_deadline_markup)
                 return REMINDER_ROUTE
 
-            reminder = ReminderObject(
-                user_id=user_id, text=data['text'], deadline=deadline, time_by=time_by).save()
-
-            detail = {"action": "remind_once",
-                      "reminder_id": reminder.id,
-                      "text": data['text'],
-                      "chat_id": user_id,
-                      "time_by": time_by.strftime("%H%M"),
-                      "token": str(uuid.uuid4())[:8]
-                      }
-            put_event(time=time, detail=detail)
+            reminder = await run_sync(ReminderObject(
+                user_id=user_id, text=data['text'], deadline=deadline, time_by=time_by, due_at=time).save)
+            await run_sync(schedule_slot, time)
         else:
             if deadline <= local_now.date():
                 await context.bot.send_message(chat_id=user_id, text="Sorry, for reminders without time specified, do set them from tomorrow onwards! If you wanna set a reminder for today, please specify a time for me to remind you on!!", reply_markup=invalid_deadline_markup)
                 return REMINDER_ROUTE
-            reminder = ReminderObject(
-                user_id=user_id, text=data['text'], deadline=deadline, time_by=time_by).save()
+            reminder = await run_sync(ReminderObject(
+                user_id=user_id, text=data['text'], deadline=deadline, time_by=time_by).save)
 
         update.callback_query = CallbackQuery(
             id=None, from_user=None, chat_instance=None, data=str(VIEW_REMINDER) + '#' + str(reminder.id))
         return await view_reminder(update, context)
 
+
+async def import_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Redirect IMPORT_ROUTE"""
+    await update.message.reply_text("Paste or forward your notes, one reminder per line, and I'll create a reminder for every line with a date. Send /done when you're finished.")
+    return IMPORT_ROUTE
+
+
+async def import_reminders_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    user_id = update.effective_chat.id
+    user = await run_sync(UserObject.get_user, user_id)
+    lines = [line.strip() for line in update.message.text.splitlines() if line.strip()]
+
+    now = datetime.datetime.utcnow()
+    local_now = now + datetime.timedelta(hours=user.timezone_offset)
+    reminders = list()
+    skipped = 0
+    for data in match_dates(lines, reference_date=local_now.date()):
+        if not data:
+            skipped += 1
+            continue
+        time_by = data['time_by']
+        deadline = data['deadline']
+
+        if time_by:
+            time = datetime.datetime.combine(
+                deadline, time_by) - datetime.timedelta(hours=user.timezone_offset)
+            if time < now:
+                skipped += 1
+                continue
+        else:
+            time = None
+            if deadline <= local_now.date():
+                skipped += 1
+                continue
+        reminders.append(ReminderObject(user_id=user_id, text=data['text'],
+                         deadline=deadline, time_by=time_by, due_at=time))
+
+    if reminders:
+        await run_sync(ReminderObject.save_many, reminders)
+        for due_at in sorted({reminder.due_at for reminder in reminders if reminder.due_at}):
+            await run_sync(schedule_slot, due_at)
+    created = len(reminders)
+
+    await update.message.reply_text("Created {} reminders, skipped {} lines without a date in the future. Send more, or /done to finish.".format(created, skipped))
+    return IMPORT_ROUTE
+
+
+async def import_done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    await update.message.reply_text("Import finished! See your reminders in /view_reminders.")
+    return USER_ROUTE
+
+
+async def import_unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Commands other than /done while importing"""
+    await update.message.reply_text("You're still importing reminders. Send /done to finish the import first.")
+
 # contact, get_feedback, unknown and exit actions
 
 
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Unknown handler"""
-    await update.message.reply_text("Sorry, I do not understand this command.\n\n Available commands:\n/view_reminders: View all reminders you have.\n/settings: Edit user settings, like timezone, wake time, enable/disable daily updates.")
+    await update.message.reply_text("Sorry, I do not understand this command.\n\n Available commands:\n/view_reminders: View all reminders you have.\n/import: Create many reminders at once from pasted notes.\n/settings: Edit user settings, like timezone, wake time, enable/disable daily updates.")
 
 
 async def unknown_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1,8 +1,11 @@
 import os
 import json
 import handlers
-import asyncio
-from mypersistence import MyPersistence
+import scheduled
+import runtime
+from classes import identity_map, user_cache
+from filter import match_date_cache
+from mypersistence import MyPersistence, default_serializer, redis_conn
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -14,15 +17,25 @@ from telegram.ext import (
     PersistenceInput,
 )
 
+try:
+    from telegram.ext._utils.trackingdict import TrackingDict
+except ImportError:
+    TrackingDict = None
+
 # Stages + Callback data
-USER_ROUTE, REMINDER_ROUTE, EDIT_REMINDER_ROUTE, SETTINGS_ROUTE, TYPE_SETTINGS_ROUTE = range(
-    5)
+USER_ROUTE, REMINDER_ROUTE, EDIT_REMINDER_ROUTE, SETTINGS_ROUTE, TYPE_SETTINGS_ROUTE, IMPORT_ROUTE = range(
+    6)
 OPTION_0, OPTION_1, OPTION_2, OPTION_3, VIEW_REMINDERS, VIEW_REMINDER, EDIT_SETTINGS, BACK = range(
     8)
 
 
 persistence = MyPersistence(function_name=os.environ.get("REDIS_LAMBDA_FUNCTION"), redis_key=os.environ.get("REDIS_KEY"),
-                            store_data=PersistenceInput(chat_data=False, bot_data=False), update_interval=60)
+                            store_data=PersistenceInput(chat_data=False, bot_data=False), update_interval=60, sharded=True, serializer=default_serializer())
+# Share parsed reminders between containers through the persistence Redis
+if os.environ.get('MATCH_DATE_CACHE_SHARED'):
+    match_date_cache.redis_conn = redis_conn
+user_cache.redis_conn = redis_conn
+
 application = Application.builder().token(
     os.environ.get('TOKEN')).persistence(persistence).build()
 
@@ -33,6 +46,7 @@ conv_handler = ConversationHandler(
         USER_ROUTE: [
             CommandHandler('settings', handlers.settings_menu),
             CommandHandler('view_reminders', handlers.view_reminders),
+            CommandHandler('import', handlers.import_reminders),
             CommandHandler('exit', handlers.exit),
             MessageHandler(filters.TEXT & ~filters.COMMAND,
                            handlers.create_reminder_text),
@@ -85,6 +99,13 @@ conv_handler = ConversationHandler(
             MessageHandler(filters.TEXT & ~filters.COMMAND,
                            handlers.edit_timezone_setting)
         ],
+        IMPORT_ROUTE: [
+            CommandHandler('done', handlers.import_done),
+            MessageHandler(filters.TEXT & ~filters.COMMAND,
+                           handlers.import_reminders_text),
+            MessageHandler(filters.COMMAND,
+                           handlers.import_unknown)
+        ],
     },
     fallbacks=[
         MessageHandler(filters.Regex("^Exit$"), exit)
@@ -95,8 +116,38 @@ conv_handler = ConversationHandler(
 application.add_handler(conv_handler)
 
 
+def conversation_key(update):
+    """The key conv_handler keeps the update's conversation under, it is per chat and per user."""
+    if update.effective_chat is None or update.effective_user is None:
+        return None
+    return (update.effective_chat.id, update.effective_user.id)
+
+
+async def refresh_conversation(update):
+    """Reloads the state of the update's conversation, which another container may have moved on
+    since this one loaded it. user_data needs nothing here, PTB calls persistence.refresh_user_data
+    before every handler."""
+    key = conversation_key(update)
+    if key is None:
+        return
+    state = persistence.refresh_conversation(conv_handler.name, key)
+    # ConversationHandler keeps its states in a private TrackingDict as of PTB 20.8
+    conversations = getattr(conv_handler, '_conversations', None)
+    if TrackingDict is None or not isinstance(conversations, TrackingDict):
+        # Let initialize() hand the handler its states again, the refreshed one included
+        await application.shutdown()
+        await application.initialize()
+    elif state is None:
+        conversations.data.pop(key, None)
+    else:
+        conversations.update_no_track({key: state})
+
+
 def lambda_handler(event, context):
-    return asyncio.get_event_loop().run_until_complete(main(event, context))
+    # Scheduler payloads skip the application, persistence and reminder parsing entirely
+    if scheduled.is_scheduled(event):
+        return runtime.run(scheduled.handle(event))
+    return runtime.run(main(event, context))
 
 
 async def main(event, context):
@@ -106,8 +157,15 @@ async def main(event, context):
                 'statusCode': 200,
                 'body': 'Warmed'
             }
+        # Objects cached by a previous invocation of this container may be stale
+        identity_map.clear()
+        update = Update.de_json(json.loads(event["body"]), application.bot)
+        if persistence.loaded:
+            await refresh_conversation(update)
+        # Only does anything on the first invocation of a container, later ones reuse the bot,
+        # its connection pool and the loaded persistence
         await application.initialize()
-        await application.process_update(Update.de_json(json.loads(event["body"]), application.bot))
+        await application.process_update(update)
         await application.update_persistence()
         await persistence.flush()
         return {
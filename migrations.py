@@ -0,0 +1,239 @@
+import sys
+import datetime
+import redis
+import dynamodb
+import mypersistence
+from botocore.exceptions import ClientError
+from telegram.ext import PersistenceInput
+from handlers import schedule_slot
+
+# One-off data migrations, run by hand against the live tables:
+#   python migrations.py create_due_index
+#   python migrations.py backfill_due_at
+#   python migrations.py create_deadline_index
+#   python migrations.py backfill_sort_deadline
+#   python migrations.py enable_expiry
+#   python migrations.py backfill_expires_at
+#   python migrations.py rewrite_persistence
+
+
+def create_due_index():
+    """Adds dueIndex to a reminders table created before it existed."""
+    dynamodb.resource.meta.client.update_table(
+        TableName='reminders',
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'dueBucket',
+                'AttributeType': 'S'
+            },
+            {
+                'AttributeName': 'dueAt',
+                'AttributeType': 'S'
+            }
+        ],
+        GlobalSecondaryIndexUpdates=[
+            {
+                'Create': dynamodb.due_index
+            }
+        ]
+    )
+
+
+def backfill_due_at():
+    """Sets dueAt and dueBucket on timed reminders that predate them, using their owner's current
+    timezone, and schedules the slots of those still in the future."""
+    now = datetime.datetime.utcnow()
+    offsets = dict()
+    updated = 0
+    for item in dynamodb.paginate(dynamodb.reminder_table.scan):
+        if not item.get('timeBy') or item.get('dueAt'):
+            continue
+        user_id = item['userId']
+        if user_id not in offsets:
+            user = dynamodb.query_user(user_id)
+            offsets[user_id] = int(user['timezoneOffset']) if user else 8
+        deadline = item['uniqueDeadline'].split('&')[0]
+        due_at = datetime.datetime.strptime(deadline + ' ' + item['timeBy'], '%d#%m#%Y %H#%M') - \
+            datetime.timedelta(hours=offsets[user_id])
+        try:
+            # Reminders deleted or edited since the scan must not come back as items without userId
+            dynamodb.reminder_table.update_item(
+                Key={
+                    'Id': item['Id']
+                },
+                UpdateExpression='SET dueAt = :due_at, dueBucket = :due_bucket',
+                ConditionExpression='uniqueDeadline = :unique_deadline AND attribute_not_exists(dueAt)',
+                ExpressionAttributeValues={
+                    ':due_at': due_at.strftime('%Y-%m-%dT%H:%M'),
+                    ':due_bucket': dynamodb.due_bucket(item['Id'], due_at.strftime('%Y-%m-%dT%H:%M')),
+                    ':unique_deadline': item['uniqueDeadline']
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        if due_at >= now:
+            schedule_slot(due_at)
+        updated += 1
+    print('Backfilled dueAt on {} reminders'.format(updated))
+    return updated
+
+
+def create_deadline_index():
+    """Adds deadlineIndex to a reminders table created before it existed."""
+    dynamodb.resource.meta.client.update_table(
+        TableName='reminders',
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'userId',
+                'AttributeType': 'N'
+            },
+            {
+                'AttributeName': 'sortDeadline',
+                'AttributeType': 'S'
+            }
+        ],
+        GlobalSecondaryIndexUpdates=[
+            {
+                'Create': dynamodb.deadline_index
+            }
+        ]
+    )
+
+
+def backfill_sort_deadline():
+    """Brings reminders written before schema 2 up to it. Reads can move to deadlineIndex, by
+    setting REMINDER_READ_SCHEMA=2, once this reports nothing left to migrate."""
+    updated = 0
+    for item in dynamodb.paginate(dynamodb.reminder_table.scan):
+        if item.get('schemaVersion', 1) >= dynamodb.schema_version:
+            continue
+        deadline, id = item['uniqueDeadline'].split('&')
+        try:
+            dynamodb.reminder_table.update_item(
+                Key={
+                    'Id': item['Id']
+                },
+                UpdateExpression='SET sortDeadline = :sort_deadline, schemaVersion = :schema_version',
+                # An edit since the scan has already dual-written the item
+                ConditionExpression='uniqueDeadline = :unique_deadline',
+                ExpressionAttributeValues={
+                    ':sort_deadline': dynamodb.sort_deadline(deadline, id),
+                    ':schema_version': dynamodb.schema_version,
+                    ':unique_deadline': item['uniqueDeadline']
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        updated += 1
+    print('Migrated {} reminders to schema {}'.format(updated, dynamodb.schema_version))
+    return updated
+
+
+def enable_expiry():
+    """Turns on TTL and the stream archive.py reads for a reminders table created without them."""
+    dynamodb.enable_expiry()
+    dynamodb.resource.meta.client.update_table(
+        TableName='reminders',
+        StreamSpecification={
+            'StreamEnabled': True,
+            'StreamViewType': 'OLD_IMAGE'
+        }
+    )
+
+
+def backfill_expires_at():
+    """Sets expiresAt on reminders written before it existed."""
+    updated = 0
+    for item in dynamodb.paginate(dynamodb.reminder_table.scan, **dynamodb.projection(['Id', 'uniqueDeadline', 'expiresAt'])):
+        if item.get('expiresAt'):
+            continue
+        deadline = item['uniqueDeadline'].split('&')[0]
+        try:
+            dynamodb.reminder_table.update_item(
+                Key={
+                    'Id': item['Id']
+                },
+                UpdateExpression='SET expiresAt = :expires_at',
+                ConditionExpression='uniqueDeadline = :unique_deadline',
+                ExpressionAttributeValues={
+                    ':expires_at': dynamodb.expires_at(deadline),
+                    ':unique_deadline': item['uniqueDeadline']
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        updated += 1
+    print('Set expiresAt on {} reminders'.format(updated))
+    return updated
+
+
+def rewrite_entry(serializer, data):
+    """Re-encodes data if it was pickled. Returns None for entries already in the msgpack format."""
+    if data is None or data.startswith(mypersistence.MsgpackSerializer.MAGIC):
+        return None
+    return serializer.dumps(serializer.loads(data))
+
+
+def rewrite_persistence():
+    """Rewrites every pickled persistence entry in the msgpack format, so PERSISTENCE_LEGACY_PICKLE
+    can be set to 0. Fields changed by the bot while they are rewritten are retried."""
+    serializer = mypersistence.MsgpackSerializer(compression='zlib', legacy_pickle=True)
+    redis_conn = mypersistence.redis_conn
+    redis_key = mypersistence.redis_key
+    updated = 0
+    for kind in ('conversations', 'user_data', 'chat_data'):
+        key = '{}:{}'.format(redis_key, kind)
+        cursor = 0
+        while True:
+            cursor, fields = redis_conn.hscan(key, cursor, count=500)
+            fields = [field for field, data in fields.items() if not data.startswith(mypersistence.MsgpackSerializer.MAGIC)]
+            while fields:
+                with redis_conn.pipeline() as pipe:
+                    try:
+                        pipe.watch(key)
+                        stored = pipe.hmget(key, fields)
+                        rewritten = {field: rewrite_entry(serializer, data) for field, data in zip(fields, stored)}
+                        rewritten = {field: data for field, data in rewritten.items() if data is not None}
+                        pipe.multi()
+                        if rewritten:
+                            pipe.hset(key, mapping=rewritten)
+                        pipe.execute()
+                        updated += len(rewritten)
+                        fields = []
+                    except redis.WatchError:
+                        continue
+            if cursor == 0:
+                break
+    bot_key = '{}:bot_data'.format(redis_key)
+    while True:
+        with redis_conn.pipeline() as pipe:
+            try:
+                pipe.watch(bot_key)
+                data = rewrite_entry(serializer, pipe.get(bot_key))
+                pipe.multi()
+                if data is not None:
+                    pipe.set(bot_key, data)
+                    updated += 1
+                pipe.execute()
+                break
+            except redis.WatchError:
+                continue
+    if redis_conn.exists(redis_key):
+        # The blob written before sharding, rewritten whole through a blob mode flush
+        persistence = mypersistence.MyPersistence(None, redis_key, PersistenceInput(), 60, serializer=serializer)
+        persistence.load_redis()
+        persistence.reencode()
+        persistence.dump_redis()
+        updated += 1
+    print('Rewrote {} persistence entries'.format(updated))
+    return updated
+
+
+if __name__ == '__main__':
+    globals()[sys.argv[1]]()
@@ -1,101 +1,476 @@
 from telegram.ext._utils.types import ConversationDict
 from telegram.ext import BasePersistence, PersistenceInput
-from copy import deepcopy
 import os
+import json
+import time
+import zlib
 import pickle
+import random
 import redis
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, Optional, Tuple
+from typing import Any, DefaultDict, Dict, Optional, Set, Tuple
+from runtime import redis_pool
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 
-redis_endpoint = os.environ["REDIS_HOST"]
-redis_port = os.environ["REDIS_PORT"]
 redis_key = os.environ["REDIS_KEY"]
+# Set to 0 once migrations.rewrite_persistence has rewritten every pickled entry
+legacy_pickle = os.environ.get('PERSISTENCE_LEGACY_PICKLE', '1') != '0'
 
 try:
-    redis_conn = redis.StrictRedis(host=redis_endpoint, port=redis_port)
+    redis_conn = redis.StrictRedis(connection_pool=redis_pool)
 except Exception:
     redis_conn = None
 
 
+def conversation_field(name: str, key: Tuple[int, ...]) -> str:
+    '''Hash field under which a single conversation key is stored in sharded mode.'''
+    return json.dumps([name, list(key)])
+
+
+def parse_conversation_field(field) -> Tuple[str, Tuple[int, ...]]:
+    name, key = json.loads(field)
+    return name, tuple(key)
+
+
+# Writes the entries in ARGV, six values each: index into KEYS, hash field ('' for a plain key),
+# check ('0' absent, '1' equal to expected, '*' anything), expected, '1' to set or '0' to delete,
+# and the new value. Nothing is written if any check fails; the failed entries are returned as
+# index, whether the entry exists and its current value.
+compare_and_set = """
+local conflicts = {}
+local function read(key, field)
+    if field == '' then
+        return redis.call('GET', key)
+    end
+    return redis.call('HGET', key, field)
+end
+for i = 1, #ARGV, 6 do
+    local check = ARGV[i + 2]
+    if check ~= '*' then
+        local current = read(KEYS[tonumber(ARGV[i])], ARGV[i + 1])
+        if (check == '0' and current) or (check == '1' and current ~= ARGV[i + 3]) then
+            table.insert(conflicts, (i - 1) / 6)
+            table.insert(conflicts, current and 1 or 0)
+            table.insert(conflicts, current or '')
+        end
+    end
+end
+if #conflicts > 0 then
+    return conflicts
+end
+for i = 1, #ARGV, 6 do
+    local key, field = KEYS[tonumber(ARGV[i])], ARGV[i + 1]
+    if ARGV[i + 4] == '1' and field == '' then
+        redis.call('SET', key, ARGV[i + 5])
+    elseif ARGV[i + 4] == '1' then
+        redis.call('HSET', key, field, ARGV[i + 5])
+    elseif field == '' then
+        redis.call('DEL', key)
+    else
+        redis.call('HDEL', key, field)
+    end
+end
+return conflicts
+"""
+
+
+class PickleSerializer(object):
+    '''Serializes with :mod:`pickle`, the format used before serializers were pluggable.'''
+
+    def dumps(self, obj) -> bytes:
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes):
+        return pickle.loads(data)
+
+
+class MsgpackSerializer(object):
+    '''Compact versioned msgpack format with optional zlib or lz4 compression.
+
+    Every payload starts with :attr:`MAGIC`, a format version byte and a compression byte.
+    Payloads without that header were written by :class:`PickleSerializer` and are still read
+    unless ``legacy_pickle`` is False, so existing state migrates as it is rewritten.
+    '''
+    MAGIC = b'AB'
+    VERSION = 1
+    NONE, ZLIB, LZ4 = range(3)
+    COMPRESSIONS = {None: NONE, 'zlib': ZLIB, 'lz4': LZ4}
+
+    def __init__(self, compression: Optional[str] = None, min_compress_size: int = 256, legacy_pickle: bool = True):
+        if msgpack is None:
+            raise RuntimeError("MsgpackSerializer requires the msgpack package")
+        if compression not in self.COMPRESSIONS:
+            raise ValueError("Unknown compression {}".format(compression))
+        if compression == 'lz4' and lz4 is None:
+            raise RuntimeError("lz4 compression requires the lz4 package")
+        self.compression = self.COMPRESSIONS[compression]
+        self.min_compress_size = min_compress_size
+        self.legacy_pickle = legacy_pickle
+
+    def dumps(self, obj) -> bytes:
+        data = msgpack.packb(obj, use_bin_type=True)
+        compression = self.NONE
+        # Small entries (most user_data) only grow when compressed
+        if self.compression != self.NONE and len(data) >= self.min_compress_size:
+            compression = self.compression
+            if compression == self.ZLIB:
+                data = zlib.compress(data)
+            else:
+                data = lz4.frame.compress(data)
+        return self.MAGIC + bytes((self.VERSION, compression)) + data
+
+    def loads(self, data: bytes):
+        if not data.startswith(self.MAGIC):
+            if not self.legacy_pickle:
+                raise ValueError("Payload is not in the msgpack format")
+            return pickle.loads(data)
+        version, compression = data[2], data[3]
+        if version != self.VERSION:
+            raise ValueError("Unsupported format version {}".format(version))
+        data = data[4:]
+        if compression == self.ZLIB:
+            data = zlib.decompress(data)
+        elif compression == self.LZ4:
+            data = lz4.frame.decompress(data)
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def default_serializer():
+    '''The compact format when msgpack is installed, pickle otherwise.'''
+    if msgpack is not None:
+        return MsgpackSerializer(compression='zlib', legacy_pickle=legacy_pickle)
+    return PickleSerializer()
+
+
 class MyPersistence(BasePersistence):
-    '''Using Redis to make the bot persistent'''
+    '''Using Redis to make the bot persistent
 
-    def __init__(self, function_name, redis_key, store_data: PersistenceInput, update_interval: int):
+    user_data, chat_data and bot_data are held as serialized snapshots of each entry instead of
+    live objects. The getters decode a fresh copy for PTB, so nothing has to be deep-copied, and
+    the update methods detect changes by comparing the serialized entry with its snapshot.
+    ``serializer`` picks the format, :class:`PickleSerializer` by default.
+
+    By default all snapshots are stored in a single blob under :attr:`redis_key`. With
+    ``sharded=True`` every conversation key and every user_id/chat_id is stored as its own
+    field of a Redis hash (``<redis_key>:conversations``, ``<redis_key>:user_data``, ...),
+    and :meth:`flush` only writes the entries that were changed since the last load. user_data
+    and chat_data are then not loaded up front: :meth:`get_user_data` starts out empty and
+    :meth:`refresh_user_data`, which PTB calls before every handler, reads and decodes the one
+    entry the update needs, so a warm container also sees changes made by other invocations.
+
+    Writes are optimistic. In sharded mode :meth:`flush` writes every changed entry in one script
+    that compares it with its value when it was loaded, so only invocations changing the same
+    user conflict; in blob mode it WATCHes the blob. Entries another invocation changed meanwhile
+    are merged per top-level key before retrying, up to ``max_retries`` times.
+    '''
+
+    def __init__(self, function_name, redis_key, store_data: PersistenceInput, update_interval: int, sharded: bool = False, serializer=None, max_retries: int = 5):
         # super().__init__(store_user_data=True, store_chat_data=True, store_bot_data=True)
         self.store_data: PersistenceInput = store_data
         self._update_interval = update_interval
         self.redis_key = redis_key
-        self.user_data: Optional[DefaultDict[int, Dict]] = None
-        self.chat_data: Optional[DefaultDict[int, Dict]] = None
-        self.bot_data: Optional[Dict] = None
-        self.bot_data: Optional[Dict] = None
-        self.conversations: Optional[Dict[str, Dict[Tuple, Any]]] = None
+        self.sharded = sharded
+        self.serializer = serializer or PickleSerializer()
+        self.max_retries = max_retries
+        self.loaded = False
+        self.user_snapshots: Dict[int, bytes] = dict()
+        self.chat_snapshots: Dict[int, bytes] = dict()
+        self.bot_snapshot: Optional[bytes] = None
+        self.conversations: Dict[str, Dict[Tuple, Any]] = dict()
+        # Entries changed since the last load or flush. flush() does no I/O while these are empty
+        # and in sharded mode only writes these entries
+        self._pending_conversations: Set[Tuple[str, Tuple]] = set()
+        self._pending_user_data: Set[int] = set()
+        self._pending_chat_data: Set[int] = set()
+        self._pending_bot_data = False
+        # Snapshots of the changed entries as they were loaded, to detect concurrent writes
+        self._user_base: Dict[int, Optional[bytes]] = dict()
+        self._chat_base: Dict[int, Optional[bytes]] = dict()
+        self._bot_base: Optional[bytes] = None
+
+    @property
+    def dirty(self) -> bool:
+        '''Whether anything was changed since the last load or flush.'''
+        return bool(self._pending_conversations or self._pending_user_data
+                    or self._pending_chat_data or self._pending_bot_data)
+
+    def snapshot_entries(self, data: Dict) -> Dict[int, bytes]:
+        '''Returns the snapshot of every entry. Blobs written before snapshots were kept hold the
+        entries themselves, so those are serialized here once.'''
+        return {int(id): entry if isinstance(entry, bytes) else self.serializer.dumps(entry)
+                for id, entry in data.items()}
+
+    def shard_key(self, kind: str) -> str:
+        return '{}:{}'.format(self.redis_key, kind)
 
     def load_redis(self):
+        if self.sharded:
+            self.load_redis_sharded()
+        else:
+            self.load_redis_blob()
+        self.loaded = True
+
+    def dump_redis(self):
+        for attempt in range(self.max_retries):
+            try:
+                if self.sharded:
+                    self.dump_redis_sharded()
+                else:
+                    self.dump_redis_blob()
+                break
+            except redis.WatchError:
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+        self._pending_conversations = set()
+        self._pending_user_data = set()
+        self._pending_chat_data = set()
+        self._pending_bot_data = False
+        self._user_base = dict()
+        self._chat_base = dict()
+
+    def reencode(self):
+        '''Serializes every loaded entry again with the serializer and marks it as changed, so that
+        the next flush writes all of them in its format. Sharded mode loads user and chat entries
+        as they are read, only those are covered there.'''
+        for snapshots, pending, base in ((self.user_snapshots, self._pending_user_data, self._user_base),
+                                         (self.chat_snapshots, self._pending_chat_data, self._chat_base)):
+            for id, data in snapshots.items():
+                base.setdefault(id, data)
+                snapshots[id] = self.serializer.dumps(self.serializer.loads(data))
+                pending.add(id)
+        if self.bot_snapshot is not None:
+            if not self._pending_bot_data:
+                self._bot_base = self.bot_snapshot
+            self.bot_snapshot = self.serializer.dumps(self.serializer.loads(self.bot_snapshot))
+            self._pending_bot_data = True
+        self._pending_conversations = {(name, key) for name, conversation in self.conversations.items()
+                                       for key in conversation}
+
+    def merge_entry(self, base: Optional[bytes], ours: Optional[bytes], theirs: Optional[bytes]) -> Optional[bytes]:
+        '''Three-way merge of an entry changed here (ours) and by another invocation (theirs).
+
+        For dicts, the top-level keys changed here are applied on top of theirs, otherwise ours wins.'''
+        if theirs == base or ours is None or theirs is None:
+            return ours
+        base_data = self.serializer.loads(base) if base else dict()
+        our_data = self.serializer.loads(ours)
+        merged = self.serializer.loads(theirs)
+        if not all(isinstance(data, dict) for data in (base_data, our_data, merged)):
+            return ours
+        for key in set(base_data) | set(our_data):
+            if key not in our_data:
+                merged.pop(key, None)
+            elif key not in base_data or our_data[key] != base_data[key]:
+                merged[key] = our_data[key]
+        return self.serializer.dumps(merged)
+
+    def merge_pending(self, stored: Dict[int, bytes], snapshots: Dict[int, bytes], pending: Set[int], base: Dict[int, Optional[bytes]]):
+        '''Merges the pending entries of snapshots with the stored ones and rebases them on stored.'''
+        for id in pending:
+            theirs = stored.get(id)
+            merged = self.merge_entry(base.get(id), snapshots.get(id), theirs)
+            if merged is None:
+                snapshots.pop(id, None)
+            else:
+                snapshots[id] = merged
+            base[id] = theirs
+
+    def load_redis_sharded(self):
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hgetall(self.shard_key('conversations'))
+        pipe.exists(self.shard_key('user_data'), self.shard_key('chat_data'))
+        pipe.get(self.shard_key('bot_data'))
+        conversations, entries, bot_data = pipe.execute()
+
+        if not (conversations or entries or bot_data) and redis_conn.exists(self.redis_key):
+            # Migrate from the single blob: load it and write every entry to its own field
+            self.load_redis_blob()
+            self._pending_conversations = {(name, key) for name, conversation in self.conversations.items()
+                                           for key in conversation}
+            self._pending_user_data = set(self.user_snapshots)
+            self._pending_chat_data = set(self.chat_snapshots)
+            self._pending_bot_data = True
+            return
+
+        self.conversations = dict()
+        for field, state in conversations.items():
+            name, key = parse_conversation_field(field)
+            self.conversations.setdefault(name, dict())[key] = self.serializer.loads(state)
+        # Entries are read one at a time by refresh_user_data and refresh_chat_data
+        self.user_snapshots = dict()
+        self.chat_snapshots = dict()
+        self.bot_snapshot = bot_data
+
+    def refresh_entry(self, kind: str, snapshots: Dict[int, bytes], id: int, data: Dict) -> None:
+        '''Makes data, PTB's dict for the entry, match what is stored for it in sharded mode.
+        Only decodes the entry if it changed since it was last read or written here.'''
+        stored = redis_conn.hget(self.shard_key(kind), str(id))
+        if snapshots.get(id) == stored:
+            return
+        data.clear()
+        if stored is None:
+            snapshots.pop(id, None)
+        else:
+            snapshots[id] = stored
+            data.update(self.serializer.loads(stored))
+
+    def refresh_conversation(self, name: str, key: Tuple[int, ...]) -> Optional[object]:
+        '''Returns the state stored for the conversation key and keeps it as the loaded one, so a
+        warm container sees the conversation where another invocation left it. Keys changed here
+        and not yet flushed are kept as they are.'''
+        if not self.sharded or (name, key) in self._pending_conversations:
+            return self.conversations.get(name, dict()).get(key)
+        stored = redis_conn.hget(self.shard_key('conversations'), conversation_field(name, key))
+        state = None if stored is None else self.serializer.loads(stored)
+        conversation = self.conversations.setdefault(name, dict())
+        if state is None:
+            conversation.pop(key, None)
+        else:
+            conversation[key] = state
+        return state
+
+    def dump_redis_sharded(self):
+        keys = [self.shard_key(kind) for kind in ('conversations', 'user_data', 'chat_data', 'bot_data')]
+        args = []
+        # What each entry of args is, to merge the ones the script reports as conflicting
+        entries = []
+        for name, key in self._pending_conversations:
+            # The latest state of a conversation key always wins
+            args.extend(('1', conversation_field(name, key), '*', '') +
+                        self.write_args(self.conversations.get(name, dict()).get(key)))
+            entries.append(None)
+        for index, snapshots, pending, base in (('2', self.user_snapshots, self._pending_user_data, self._user_base),
+                                                ('3', self.chat_snapshots, self._pending_chat_data, self._chat_base)):
+            for id in pending:
+                args.extend((index, str(id)) + self.check_args(base.get(id)) + self.write_args(snapshots.get(id), False))
+                entries.append((snapshots, pending, base, id))
+        if self._pending_bot_data:
+            args.extend(('4', '') + self.check_args(self._bot_base) + self.write_args(self.bot_snapshot, False))
+            entries.append('bot_data')
+
+        conflicts = redis_conn.register_script(compare_and_set)(keys=keys, args=args)
+        if conflicts:
+            for i, exists, current in zip(*[iter(conflicts)] * 3):
+                theirs = current if exists else None
+                if entries[i] == 'bot_data':
+                    self.bot_snapshot = self.merge_entry(self._bot_base, self.bot_snapshot, theirs)
+                    self._bot_base = theirs
+                else:
+                    snapshots, pending, base, id = entries[i]
+                    self.merge_pending({id: theirs} if exists else dict(), snapshots, {id}, base)
+            raise redis.WatchError('{} entries were changed by another invocation'.format(len(conflicts) // 3))
+
+    def check_args(self, base: Optional[bytes]) -> Tuple[str, bytes]:
+        if base is None:
+            return '0', b''
+        return '1', base
+
+    def write_args(self, data, serialize: bool = True) -> Tuple[str, bytes]:
+        if data is None:
+            return '0', b''
+        return '1', self.serializer.dumps(data) if serialize else data
+
+    def decode_blob(self, response):
+        '''Returns the conversations, user_data, chat_data and bot_data snapshots of a blob.'''
+        response = self.serializer.loads(response)
+        user_snapshots = self.snapshot_entries(response['user_data'])
+        chat_snapshots = self.snapshot_entries(response['chat_data'])
+        # For backwards compatibility with files not containing bot data
+        bot_data = response.get('bot_data', dict())
+        bot_snapshot = bot_data if isinstance(bot_data, bytes) else self.serializer.dumps(bot_data)
+        if 'version' in response:
+            conversations = dict()
+            for field, state in response['conversations'].items():
+                name, key = parse_conversation_field(field)
+                conversations.setdefault(name, dict())[key] = state
+        else:
+            conversations = response.get('conversations', dict())
+        return conversations, user_snapshots, chat_snapshots, bot_snapshot
+
+    def load_redis_blob(self):
         try:
-            response = redis_conn.get(redis_key)
+            response = redis_conn.get(self.redis_key)
             if response:
-                response = pickle.loads(response)
-                self.user_data = defaultdict(dict, response['user_data'])
-                self.chat_data = defaultdict(dict, response['chat_data'])
-                # For backwards compatibility with files not containing bot data
-                self.bot_data = response.get('bot_data', dict())
-                self.conversations = response.get('conversations', dict())
+                self.conversations, self.user_snapshots, self.chat_snapshots, self.bot_snapshot = self.decode_blob(
+                    response)
             else:
                 self.conversations = dict()
-                self.user_data = defaultdict(dict)
-                self.chat_data = defaultdict(dict)
-                self.bot_data = dict()
+                self.user_snapshots = dict()
+                self.chat_snapshots = dict()
+                self.bot_snapshot = None
         except Exception as exc:
             raise exc
-            self.conversations = dict()
-            self.user_data = defaultdict(dict)
-            self.chat_data = defaultdict(dict)
-            self.bot_data = dict()
 
-    def dump_redis(self):
-        data = {
-            'conversations': self.conversations,
-            'user_data': self.user_data,
-            'chat_data': self.chat_data,
-            'bot_data': self.bot_data,
-        }
-        data = pickle.dumps(data)
-        try:
-            redis_conn.set(redis_key, data)
-        except Exception as exc:
-            raise exc
+    def dump_redis_blob(self):
+        with redis_conn.pipeline() as pipe:
+            pipe.watch(self.redis_key)
+            response = pipe.get(self.redis_key)
+            if response:
+                conversations, user_snapshots, chat_snapshots, bot_snapshot = self.decode_blob(response)
+            else:
+                conversations, user_snapshots, chat_snapshots, bot_snapshot = dict(), dict(), dict(), None
+
+            # Start from what is stored now and apply only the changes made here
+            for name, key in self._pending_conversations:
+                conversations.setdefault(name, dict())[key] = self.conversations.get(name, dict()).get(key)
+            for stored, snapshots, pending, base in ((user_snapshots, self.user_snapshots, self._pending_user_data, self._user_base),
+                                                     (chat_snapshots, self.chat_snapshots, self._pending_chat_data, self._chat_base)):
+                self.merge_pending(dict(stored), snapshots, pending, base)
+                for id in pending:
+                    if id in snapshots:
+                        stored[id] = snapshots[id]
+                    else:
+                        stored.pop(id, None)
+            if self._pending_bot_data:
+                bot_snapshot = self.merge_entry(self._bot_base, self.bot_snapshot, bot_snapshot)
+            self.conversations, self.user_snapshots, self.chat_snapshots = conversations, user_snapshots, chat_snapshots
+            self.bot_snapshot = bot_snapshot
+
+            # Conversation keys are tuples, which not every format can use as map keys
+            data = {
+                'version': 2,
+                'conversations': {conversation_field(name, key): state for name, conversation in self.conversations.items()
+                                  for key, state in conversation.items()},
+                'user_data': self.user_snapshots,
+                'chat_data': self.chat_snapshots,
+                'bot_data': self.bot_snapshot or self.serializer.dumps(dict()),
+            }
+            pipe.multi()
+            pipe.set(self.redis_key, self.serializer.dumps(data))
+            pipe.execute()
 
     async def get_user_data(self) -> DefaultDict[int, Dict[Any, Any]]:
         '''Returns the user_data from the pickle on Redis if it exists or an empty :obj:`defaultdict`.'''
-        if self.user_data:
-            pass
-        else:
+        if not self.loaded:
             self.load_redis()
-        return deepcopy(self.user_data)  # type: ignore[arg-type]
+        return defaultdict(dict, {user_id: self.serializer.loads(data) for user_id, data in self.user_snapshots.items()})
 
     async def get_chat_data(self) -> DefaultDict[int, Dict[Any, Any]]:
         '''Returns the chat_data from the pickle on Redis if it exists or an empty :obj:`defaultdict`.'''
-        if self.chat_data:
-            pass
-        else:
+        if not self.loaded:
             self.load_redis()
-        return deepcopy(self.chat_data)  # type: ignore[arg-type]
+        return defaultdict(dict, {chat_id: self.serializer.loads(data) for chat_id, data in self.chat_snapshots.items()})
 
     async def get_bot_data(self) -> Dict[Any, Any]:
         '''Returns the bot_data from the pickle on Redis if it exists or an empty :obj:`dict`.'''
-        if self.bot_data:
-            pass
-        else:
+        if not self.loaded:
             self.load_redis()
-        return deepcopy(self.bot_data)  # type: ignore[arg-type]
+        return self.serializer.loads(self.bot_snapshot) if self.bot_snapshot else dict()
 
     async def get_conversations(self, name: str) -> ConversationDict:
         '''Returns the conversations from the pickle on Redis if it exsists or an empty dict.'''
-        if self.conversations:
-            pass
-        else:
+        if not self.loaded:
             self.load_redis()
         # type: ignore[union-attr]
         return self.conversations.get(name, dict()).copy()
@@ -105,70 +480,79 @@ class MyPersistence(BasePersistence):
 
     async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
         '''Will update the conversations for the given handler and depending on :attr:`on_flush` save the pickle on Redis.'''
-        if not self.conversations:
-            self.conversations = dict()
         if self.conversations.setdefault(name, dict()).get(key) == new_state:
             return
         self.conversations[name][key] = new_state
+        self._pending_conversations.add((name, key))
 
     async def update_user_data(self, user_id: int, data: Dict) -> None:
         '''Will update the user_data and depending on :attr:`on_flush` save the pickle on Redis.'''
         if self.store_data.user_data:
-            if self.user_data is None:
-                self.user_data = defaultdict(dict)
-            if self.user_data.get(user_id) == data:
+            snapshot = self.serializer.dumps(data)
+            if self.user_snapshots.get(user_id) == snapshot:
                 return
-            self.user_data[user_id] = data
-        else:
-            self.user_data = defaultdict(dict)
+            self._user_base.setdefault(user_id, self.user_snapshots.get(user_id))
+            self.user_snapshots[user_id] = snapshot
+            self._pending_user_data.add(user_id)
 
     async def update_chat_data(self, chat_id: int, data: Dict) -> None:
         '''Will update the chat_data and depending on :attr:`on_flush` save the pickle on Redis.'''
         if self.store_data.chat_data:
-            if self.chat_data is None:
-                self.chat_data = defaultdict(dict)
-            if self.chat_data.get(chat_id) == data:
+            snapshot = self.serializer.dumps(data)
+            if self.chat_snapshots.get(chat_id) == snapshot:
                 return
-            self.chat_data[chat_id] = data
-        else:
-            self.chat_data = defaultdict(dict)
+            self._chat_base.setdefault(chat_id, self.chat_snapshots.get(chat_id))
+            self.chat_snapshots[chat_id] = snapshot
+            self._pending_chat_data.add(chat_id)
 
     async def update_bot_data(self, data: Dict) -> None:
         '''Will update the bot_data and depending on :attr:`on_flush` save the pickle on Redis.'''
-        if self.bot_data == data:
+        snapshot = self.serializer.dumps(data)
+        if self.bot_snapshot == snapshot:
             return
-        self.bot_data = data.copy()
+        if not self._pending_bot_data:
+            self._bot_base = self.bot_snapshot
+        self.bot_snapshot = snapshot
+        self._pending_bot_data = True
 
     async def update_callback_data(self, data):
         pass
 
     async def flush(self) -> None:
-        '''Will save all data in memory to pickle on Redis.'''
+        '''Will save the changed data in memory to pickle on Redis, does nothing if nothing changed.'''
+        if not self.dirty:
+            return
         self.dump_redis()
 
     async def drop_chat_data(self, chat_id):
-        if self.chat_data is None:
-            return
-        self.chat_data.pop(chat_id, None)
+        # In sharded mode the entry may be stored without having been read here
+        if chat_id in self.chat_snapshots or self.sharded:
+            self._chat_base.setdefault(chat_id, self.chat_snapshots.pop(chat_id, None))
+            self._pending_chat_data.add(chat_id)
 
     async def drop_user_data(self, user_id):
-        if self.user_data is None:
-            return
-        self.user_data.pop(user_id, None)
+        if user_id in self.user_snapshots or self.sharded:
+            self._user_base.setdefault(user_id, self.user_snapshots.pop(user_id, None))
+            self._pending_user_data.add(user_id)
 
     async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
-        """Does nothing.
+        """Loads the user's entry in sharded mode. Entries changed here and not yet flushed are
+        kept as they are.
 
         .. versionadded:: 13.6
         .. seealso:: :meth:`telegram.ext.BasePersistence.refresh_user_data`
         """
+        if self.sharded and user_id not in self._pending_user_data:
+            self.refresh_entry('user_data', self.user_snapshots, user_id, user_data)
 
     async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
-        """Does nothing.
+        """Loads the chat's entry in sharded mode, like :meth:`refresh_user_data`.
 
         .. versionadded:: 13.6
         .. seealso:: :meth:`telegram.ext.BasePersistence.refresh_chat_data`
         """
+        if self.sharded and chat_id not in self._pending_chat_data:
+            self.refresh_entry('chat_data', self.chat_snapshots, chat_id, chat_data)
 
     async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
         """Does nothing.
@@ -0,0 +1,41 @@
+import os
+import asyncio
+import redis
+from botocore.config import Config
+
+# Everything here lives as long as the container, so warm invocations reuse open connections
+# instead of paying for new TCP and TLS handshakes.
+
+# The bot's HTTPX pool and other async clients are tied to the loop they first ran on
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+# Shared by every boto3 client and resource. The pool covers the async_dynamodb executor and
+# parallel scans, and standard retries back off on throttling instead of failing the update.
+boto_config = Config(
+    max_pool_connections=int(os.environ.get('BOTO_MAX_POOL_CONNECTIONS', 16)),
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={
+        'mode': 'standard',
+        'max_attempts': 3
+    }
+)
+
+# ElastiCache drops idle connections, so check them before reuse after a quiet spell
+redis_pool = redis.ConnectionPool(
+    host=os.environ.get('REDIS_HOST'),
+    port=int(os.environ.get('REDIS_PORT', 6379)),
+    max_connections=int(os.environ.get('REDIS_MAX_CONNECTIONS', 16)),
+    socket_keepalive=True,
+    socket_connect_timeout=2,
+    socket_timeout=5,
+    health_check_interval=30,
+    retry_on_timeout=True
+)
+
+
+def run(coroutine):
+    """Runs coroutine to completion on the container's event loop."""
+    return loop.run_until_complete(coroutine)
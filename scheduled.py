@@ -0,0 +1,133 @@
+import os
+import json
+import asyncio
+import httpx
+import dynamodb
+from async_dynamodb import run_sync
+from ratelimit import RateLimiter
+
+# Scheduler invocations only need to send one message, so they talk to the Bot API directly
+# instead of initializing the application. The client is kept across invocations of a warm
+# container so its connection to api.telegram.org is reused.
+api_url = 'https://api.telegram.org/bot{}/'.format(os.environ.get('TOKEN'))
+client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0),
+                           limits=httpx.Limits(max_connections=8, max_keepalive_connections=8))
+# Telegram allows a bot about 30 messages per second to different chats
+rate = float(os.environ.get('REMIND_RATE', 30))
+
+
+class ApiError(Exception):
+    """A Bot API call that returned ok false, with the retry_after of 429 responses."""
+
+    def __init__(self, data):
+        super(ApiError, self).__init__(data.get('description'))
+        self.error_code = data.get('error_code')
+        self.retry_after = data.get('parameters', dict()).get('retry_after')
+
+
+def is_scheduled(event):
+    return isinstance(event, dict) and event.get('action') in actions
+
+
+def reminder_text(detail):
+    time_by = detail.get('time_by')
+    if time_by:
+        return "Reminder: {}\n(by {}:{})".format(detail['text'], time_by[:2], time_by[2:])
+    return "Reminder: {}".format(detail['text'])
+
+
+async def send_message(chat_id, text):
+    response = await client.post(api_url + 'sendMessage', json={'chat_id': chat_id, 'text': text})
+    data = response.json()
+    if not data.get('ok'):
+        raise ApiError(data)
+    return data['result']
+
+
+def item_detail(item):
+    return {'id': item['Id'], 'chat_id': int(item['userId']), 'text': item['text'],
+            'time_by': item['timeBy'].replace('#', '') if item.get('timeBy') else None}
+
+
+def slot_details(items, slot):
+    """item_detail of every item not sent by an earlier attempt at the slot. Items that can't be
+    sent, like ones left without a userId, are logged and skipped so they don't hold up the rest
+    of the slot."""
+    details = list()
+    for item in items:
+        if item.get('remindedSlot') == slot:
+            continue
+        try:
+            details.append(item_detail(item))
+        except Exception as e:
+            print('Skipping reminder {}: {!r}'.format(item.get('Id'), e))
+    return details
+
+
+async def send_reminder(limiter, item):
+    """Sends one reminder within the rate limit, waiting out 429s. Returns 'sent', 'blocked' if the
+    user blocked the bot, or 'failed'."""
+    for attempt in range(3):
+        await limiter.acquire()
+        try:
+            await send_message(item['chat_id'], reminder_text(item))
+            return 'sent'
+        except ApiError as e:
+            if e.retry_after:
+                await asyncio.sleep(e.retry_after)
+                continue
+            print(e)
+            return 'blocked' if e.error_code == 403 else 'failed'
+        except Exception as e:
+            print(e)
+            return 'failed'
+    return 'failed'
+
+
+async def remind_slot(detail):
+    """Sends every reminder due in the slot minute, as stored when the slot fires.
+
+    If any fail, the ones sent are marked and the invocation fails, so Scheduler retries the slot
+    for the rest."""
+    slot = detail['slot']
+    items = await run_sync(lambda: slot_details(dynamodb.iter_due_reminders(slot), slot))
+    limiter = RateLimiter(rate)
+    results = await asyncio.gather(*[send_reminder(limiter, item) for item in items])
+    stats = {'slot': slot, 'sent': results.count('sent'), 'blocked': results.count('blocked'),
+             'failed': results.count('failed')}
+    print(stats)
+    if stats['failed']:
+        await run_sync(dynamodb.mark_reminded, [item['id'] for item, result in zip(items, results) if result != 'failed'], slot)
+        raise Exception('{} of {} reminders in slot {} failed'.format(stats['failed'], len(items), slot))
+    return {
+        'statusCode': 200,
+        'body': json.dumps(stats)
+    }
+
+
+async def remind_once(detail):
+    """Schedules created before slots carry their own text, so check the reminder still exists and
+    hasn't been moved. Reminders with a dueAt are sent by their slot instead."""
+    item = await run_sync(dynamodb.query_reminder, detail['reminder_id'])
+    if not item or item.get('dueAt') or item_detail(item)['time_by'] != detail.get('time_by'):
+        return {
+            'statusCode': 200,
+            'body': 'Stale'
+        }
+    await send_message(detail['chat_id'], reminder_text(item_detail(item)))
+    return {
+        'statusCode': 200,
+        'body': 'Reminded'
+    }
+
+
+actions = {'remind_once': remind_once, 'remind_slot': remind_slot}
+
+
+async def handle(event):
+    try:
+        return await actions[event['action']](event)
+    except Exception as e:
+        print({'action': event.get('action'), 'error': str(e)})
+        # Scheduler invokes the function asynchronously, and Lambda only retries invocations that raise
+        raise
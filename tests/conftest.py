@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+# The modules read these at import time
+os.environ.setdefault('REDIS_HOST', 'localhost')
+os.environ.setdefault('REDIS_PORT', '6379')
+os.environ.setdefault('REDIS_KEY', 'test')
+os.environ.setdefault('TOKEN', '123:test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    """The users, reminders and reminderHistory tables on moto."""
+    moto = pytest.importorskip('moto')
+    import boto3
+    import dynamodb
+    with moto.mock_aws():
+        # Resources created before the mock started would still call AWS
+        resource = boto3.resource('dynamodb')
+        monkeypatch.setattr(dynamodb, 'resource', resource)
+        monkeypatch.setattr(dynamodb, 'user_table', resource.Table('users'))
+        monkeypatch.setattr(dynamodb, 'reminder_table', resource.Table('reminders'))
+        monkeypatch.setattr(dynamodb, 'history_table', resource.Table('reminderHistory'))
+        dynamodb.create_tables()
+        yield dynamodb
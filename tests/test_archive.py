@@ -0,0 +1,57 @@
+import datetime
+from boto3.dynamodb.types import TypeSerializer
+import archive
+import dynamodb
+
+serializer = TypeSerializer()
+ttl_identity = {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'}
+
+
+def remove_record(item, identity=None):
+    """A REMOVE record of the reminders stream, with the OLD_IMAGE view."""
+    record = {'eventName': 'REMOVE',
+              'dynamodb': {'OldImage': {key: serializer.serialize(value) for key, value in item.items()}}}
+    if identity:
+        record['userIdentity'] = identity
+    return record
+
+
+def reminder(text, time_by=None, id='00000000-0000-0000-0000-000000000001'):
+    return dynamodb.reminder_item(id, 1, text, '16#03#2027', time_by)
+
+
+def test_only_ttl_deletes_are_expired():
+    item = reminder('buy hamster')
+    assert archive.is_expired(remove_record(item, ttl_identity))
+    # Deleted from /view_reminders
+    assert not archive.is_expired(remove_record(item))
+    assert not archive.is_expired(remove_record(item, {'type': 'Service', 'principalId': 'other.amazonaws.com'}))
+    assert not archive.is_expired(dict(remove_record(item, ttl_identity), eventName='MODIFY'))
+
+
+def test_history_item():
+    assert archive.history_item(remove_record(reminder('buy hamster', '18#30'))['dynamodb']['OldImage']) == {
+        'userId': 1, 'sortDeadline': '2027-03-16&00000000-0000-0000-0000-000000000001',
+        'text': 'buy hamster', 'timeBy': '18#30'}
+    # Written before schema 2
+    legacy = reminder('buy hamster')
+    del legacy['sortDeadline'], legacy['schemaVersion']
+    assert archive.history_item(remove_record(legacy)['dynamodb']['OldImage']) == {
+        'userId': 1, 'sortDeadline': '2027-03-16&00000000-0000-0000-0000-000000000001', 'text': 'buy hamster'}
+
+
+def test_lambda_handler_archives_expired_reminders_only(tables):
+    expired = reminder('expired', id='00000000-0000-0000-0000-000000000001')
+    deleted = reminder('deleted', id='00000000-0000-0000-0000-000000000002')
+    event = {'Records': [remove_record(expired, ttl_identity), remove_record(deleted)]}
+
+    assert archive.lambda_handler(event, None)['body'] == 'Archived 1'
+    assert [item['text'] for item in tables.paginate(tables.history_table.scan)] == ['expired']
+
+
+def test_expires_at_is_the_retention_period_after_the_deadline(monkeypatch):
+    deadline = datetime.datetime(2027, 3, 16, tzinfo=datetime.timezone.utc)
+    assert dynamodb.expires_at('16#03#2027') == int((deadline + datetime.timedelta(days=dynamodb.expiry_days)).timestamp())
+    monkeypatch.setattr(dynamodb, 'expiry_days', 7)
+    assert dynamodb.expires_at('16#03#2027') == int(datetime.datetime(2027, 3, 23, tzinfo=datetime.timezone.utc).timestamp())
+    assert reminder('buy hamster')['expiresAt'] == dynamodb.expires_at('16#03#2027')
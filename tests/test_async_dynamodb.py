@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from async_dynamodb import run_sync
+
+
+def test_run_sync_runs_on_the_executor():
+    async def main():
+        return await run_sync(lambda: threading.current_thread().name)
+    assert asyncio.run(main()).startswith('dynamodb')
+
+
+def test_run_sync_passes_arguments(tables):
+    async def main():
+        await asyncio.gather(*[run_sync(tables.add_user, user_id) for user_id in range(10)])
+        await run_sync(tables.update_user, 3, remind_setting=0, timezone_offset=-5, wake_time=7)
+        return await asyncio.gather(*[run_sync(tables.query_user, user_id) for user_id in range(10)])
+
+    users = asyncio.run(main())
+    assert [int(user['userId']) for user in users] == list(range(10))
+    assert (users[3]['remindSetting'], users[3]['timezoneOffset'], users[3]['wakeTime']) == (0, -5, 7)
+
+
+def test_run_sync_iterates_generators(tables):
+    async def main():
+        await run_sync(tables.put_reminders, [{'user_id': 1, 'text': 'note {}'.format(i), 'deadline': '16#03#2027',
+                                               'time_by': None} for i in range(30)])
+        return await run_sync(lambda: list(tables.iter_reminders(1)))
+
+    assert sorted(item['text'] for item in asyncio.run(main())) == sorted('note {}'.format(i) for i in range(30))
+
+
+def test_run_sync_raises_errors(tables):
+    async def main():
+        await run_sync(tables.resource.Table('missing').get_item, Key={'userId': 1})
+
+    with pytest.raises(ClientError):
+        asyncio.run(main())
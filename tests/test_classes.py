@@ -0,0 +1,72 @@
+import datetime
+import fakeredis
+import redis
+from classes import UserCache
+
+
+class DownRedis(object):
+    def get(self, key):
+        raise redis.ConnectionError('down')
+
+    def set(self, key, value, ex=None):
+        raise redis.ConnectionError('down')
+
+
+def test_user_cache_sees_saves_from_other_containers():
+    conn = fakeredis.FakeStrictRedis()
+    first, second = UserCache(redis_conn=conn), UserCache(redis_conn=conn)
+    first.put(1, {'timezone_offset': 8})
+    assert second.get(1) == (True, {'timezone_offset': 8})
+    first.put(1, {'timezone_offset': -5})
+    assert second.get(1) == (True, {'timezone_offset': -5})
+    first.invalidate(1)
+    assert second.get(1) == (False, None)
+
+
+def test_user_cache_serves_local_entries_while_redis_is_down():
+    cache = UserCache(redis_conn=fakeredis.FakeStrictRedis())
+    cache.put(1, {'timezone_offset': 8})
+    cache.redis_conn = DownRedis()
+    assert cache.get(1) == (True, {'timezone_offset': 8})
+    assert cache.get(2) == (False, None)
+
+
+def test_user_cache_without_redis_expires_local_entries():
+    cache = UserCache(ttl=0)
+    cache.put(1, None)
+    assert cache.get(1) == (False, None)
+    cache = UserCache()
+    cache.put(1, None)
+    assert cache.get(1) == (True, None)
+
+
+def test_save_many_and_delete_by_params_keep_the_identity_map(tables):
+    from classes import ReminderObject, identity_map
+    identity_map.clear()
+    day, next_day = datetime.date(2027, 3, 16), datetime.date(2027, 3, 17)
+    reminders = ReminderObject.save_many([ReminderObject(1, 'first', day), ReminderObject(1, 'second', day),
+                                          ReminderObject(1, 'later', next_day), ReminderObject(2, 'other', day)])
+    assert all(reminder.id for reminder in reminders)
+    assert identity_map.reminders == {reminder.id: reminder for reminder in reminders}
+    assert ReminderObject.get_reminder(reminders[0].id) is reminders[0]
+
+    ReminderObject.delete_by_params(1, day)
+    assert identity_map.reminders == {reminder.id: reminder for reminder in reminders[2:]}
+    identity_map.clear()
+    assert sorted(reminder.text for reminder in ReminderObject.reminders_by_page(1)['reminders']) == ['later']
+    assert [reminder.text for reminder in ReminderObject.reminders_by_page(2)['reminders']] == ['other']
+
+    ReminderObject.get_reminder(reminders[2].id)
+    ReminderObject.delete_many(reminders[2:3])
+    assert reminders[2].id not in identity_map.reminders
+    assert ReminderObject.reminders_by_page(1)['reminders'] == []
+
+
+def test_user_cache_keys_are_prefixed_with_redis_key():
+    import classes
+    conn = fakeredis.FakeStrictRedis()
+    cache, other_deployment = UserCache(redis_conn=conn, redis_key='test'), UserCache(redis_conn=conn, redis_key='staging')
+    cache.put(1, {'timezone_offset': 8})
+    assert conn.keys() == [b'test:user:1']
+    assert other_deployment.get(1) == (False, None)
+    assert classes.user_cache.redis_key(1) == 'test:user:1'
@@ -0,0 +1,86 @@
+import time
+import asyncio
+import datetime
+import pytest
+from telegram.error import Forbidden, RetryAfter
+import digest
+
+
+class StubBot(object):
+    """Records sent digests and raises errors[chat_id] once per entry, if any."""
+
+    def __init__(self, errors=None):
+        self.errors = errors or dict()
+        self.initialized = 0
+        self.sent = list()
+
+    async def initialize(self):
+        self.initialized += 1
+
+    async def send_message(self, chat_id, text):
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    stub = StubBot()
+    monkeypatch.setattr(digest, 'bot', stub)
+    return stub
+
+
+def add_user(tables, user_id, wake_time, timezone_offset=0, remind_setting=1, reminders=()):
+    tables.upsert_user(user_id, remind_setting, timezone_offset, wake_time)
+    local_date = datetime.datetime.utcnow() + datetime.timedelta(hours=timezone_offset)
+    for text, time_by in reminders:
+        tables.add_reminder(user_id, text, local_date.strftime('%d#%m#%Y'), time_by)
+
+
+@pytest.mark.parametrize('event,hour', [
+    ({'hour': '7'}, 7),
+    ({'time': '2027-03-16T23:00:00Z'}, 23),
+])
+def test_digest_hour(event, hour):
+    assert digest.digest_hour(event) == hour
+
+
+def test_due_users_include_wake_times_before_utc_midnight(tables):
+    add_user(tables, 1, 23)
+    # 07:00 at UTC+8 is stored as 7 - 8
+    add_user(tables, 2, -1, timezone_offset=8)
+    add_user(tables, 3, 23, remind_setting=0)
+    add_user(tables, 4, 22)
+    add_user(tables, 5, -2, timezone_offset=9)
+
+    assert sorted(user.user_id for user in digest.due_users(23)) == [1, 2]
+
+
+def test_send_digests_stats(tables, bot):
+    add_user(tables, 1, 23, reminders=[('call Casey', None), ('buy hamster', '18#30')])
+    add_user(tables, 2, -1, timezone_offset=8, reminders=[('pay rent', None)])
+    add_user(tables, 3, 23)
+    add_user(tables, 4, 23, reminders=[('blocked', None)])
+    add_user(tables, 5, 23, reminders=[('throttled', None)])
+    add_user(tables, 6, 22, reminders=[('other hour', None)])
+    bot.errors = {4: [Forbidden('blocked')], 5: [RetryAfter(0)]}
+
+    stats = asyncio.run(digest.send_digests(23))
+    assert {key: stats[key] for key in ('hour', 'users', 'sent', 'empty', 'failed')} == {
+        'hour': 23, 'users': 5, 'sent': 3, 'empty': 1, 'failed': 1}
+    sent = {chat_id: text for chat_id, text, _ in bot.sent}
+    assert sorted(sent) == [1, 2, 5]
+    assert sent[1] == "Good morning! Here's what you have today:\n\n1. buy hamster (by 18:30)\n2. call Casey"
+    assert bot.initialized == 1
+
+
+def test_send_digests_keeps_to_the_rate(tables, bot, monkeypatch):
+    monkeypatch.setattr(digest, 'rate', 4)
+    for user_id in range(1, 7):
+        add_user(tables, user_id, 23, reminders=[('water the plants', None)])
+
+    stats = asyncio.run(digest.send_digests(23))
+    assert stats['sent'] == 6
+    times = sorted(sent_at for _, _, sent_at in bot.sent)
+    # A burst of rate messages, then one every 1 / rate seconds
+    assert times[-1] - times[0] >= (6 - 4) / 4 - 0.05
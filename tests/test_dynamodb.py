@@ -0,0 +1,156 @@
+import time
+import datetime
+import threading
+from boto3.dynamodb.conditions import Key
+import migrations
+
+# Across a month and a year boundary, where dd#mm#YYYY and YYYY-MM-DD orders disagree
+deadlines = ['{:%d#%m#%Y}'.format(datetime.date(2022, 12, 27) + datetime.timedelta(days=day)) for day in range(0, 50, 2)]
+
+
+def add_legacy_reminders(tables, user_id):
+    """Puts reminders as they were written before schema 2, without sortDeadline."""
+    for number, deadline in enumerate(deadlines):
+        id = '00000000-0000-0000-0000-{:012d}'.format(number)
+        tables.reminder_table.put_item(Item={'Id': id, 'userId': user_id, 'text': str(number),
+                                             'uniqueDeadline': deadline + '&' + id, 'timeBy': None})
+
+
+def read_pages(tables, user_id, last_evaluated_key=None):
+    texts = list()
+    while True:
+        page = tables.query_reminders_page(user_id, last_evaluated_key)
+        texts.extend(reminder['text'] for reminder in page['reminders'])
+        last_evaluated_key = page['LastEvaluatedKey']
+        if not last_evaluated_key:
+            return texts
+
+
+def test_schema_2_pages_backfilled_reminders_in_deadline_order(tables, monkeypatch):
+    add_legacy_reminders(tables, 1)
+    assert migrations.backfill_sort_deadline() == len(deadlines)
+    assert migrations.backfill_sort_deadline() == 0
+    monkeypatch.setattr(tables, 'read_schema_version', 2)
+
+    assert read_pages(tables, 1) == [str(number) for number in range(len(deadlines))]
+
+
+def test_schema_1_pages_by_day_of_month(tables):
+    add_legacy_reminders(tables, 1)
+    texts = read_pages(tables, 1)
+    assert sorted(texts, key=int) == [str(number) for number in range(len(deadlines))]
+    assert texts != sorted(texts, key=int)
+
+
+def test_schema_2_continues_from_a_legacy_page_key(tables, monkeypatch):
+    add_legacy_reminders(tables, 1)
+    migrations.backfill_sort_deadline()
+    # A uniqueDeadline page key saved in user_data while reads were on schema 1
+    legacy_key = tables.query_reminders_page(1)['LastEvaluatedKey']
+    assert '#' in legacy_key
+    monkeypatch.setattr(tables, 'read_schema_version', 2)
+
+    after = int(tables.query_reminder(legacy_key.split('&')[1])['text'])
+    assert read_pages(tables, 1, legacy_key) == [str(number) for number in range(after + 1, len(deadlines))]
+
+
+def unprocessed_first_call(monkeypatch, tables):
+    """Makes the first BatchWriteItem call write one request and hand back the rest as
+    UnprocessedItems. Returns the number of requests in each call."""
+    client = tables.reminder_table.meta.client
+    batch_write_item = client.batch_write_item
+    calls = list()
+
+    def stub(RequestItems):
+        requests = RequestItems['reminders']
+        calls.append(len(requests))
+        if len(calls) == 1:
+            response = batch_write_item(RequestItems={'reminders': requests[:1]})
+            response['UnprocessedItems'] = {'reminders': requests[1:]}
+            return response
+        return batch_write_item(RequestItems=RequestItems)
+
+    monkeypatch.setattr(client, 'batch_write_item', stub)
+    return calls
+
+
+def test_put_reminders_resends_unprocessed_items(tables, monkeypatch):
+    calls = unprocessed_first_call(monkeypatch, tables)
+    ids = tables.put_reminders([{'user_id': 1, 'text': str(number), 'deadline': '16#03#2027', 'time_by': None}
+                                for number in range(30)])
+
+    assert calls == [25, 25, 4]
+    assert sorted(int(item['text']) for item in tables.query_reminders(1)) == list(range(30))
+    assert sorted(item['Id'] for item in tables.query_reminders(1)) == sorted(ids)
+
+
+def test_delete_reminders_by_id_resends_unprocessed_items(tables, monkeypatch):
+    ids = tables.put_reminders([{'user_id': 1, 'text': str(number), 'deadline': '16#03#2027', 'time_by': None}
+                                for number in range(30)])
+    calls = unprocessed_first_call(monkeypatch, tables)
+    tables.delete_reminders_by_id(ids[:28])
+
+    assert calls == [25, 25, 2]
+    assert sorted(item['Id'] for item in tables.query_reminders(1)) == sorted(ids[28:])
+
+
+class CountingTable(object):
+    """Passes scans and queries through to table, recording their ExclusiveStartKey and the
+    threads that made them."""
+
+    def __init__(self, table):
+        self.table = table
+        self.start_keys = list()
+        self.threads = set()
+
+    def record(self, kwargs):
+        self.start_keys.append(kwargs.get('ExclusiveStartKey'))
+        self.threads.add(threading.current_thread())
+
+    def scan(self, **kwargs):
+        self.record(kwargs)
+        return self.table.scan(**kwargs)
+
+    def query(self, **kwargs):
+        self.record(kwargs)
+        return self.table.query(**kwargs)
+
+
+def add_users(tables, count, wake_time=7):
+    for user_id in range(1, count + 1):
+        tables.upsert_user(user_id, 1, 8, wake_time)
+
+
+def test_paginate_follows_last_evaluated_key(tables):
+    add_users(tables, 25)
+    table = CountingTable(tables.user_table)
+    items = list(tables.paginate(table.query, IndexName='userIndex', Limit=4,
+                                 KeyConditionExpression=Key('wakeTime').eq(7)))
+
+    assert sorted(int(item['userId']) for item in items) == list(range(1, 26))
+    assert len(table.start_keys) == 7
+    assert table.start_keys[0] is None and all(table.start_keys[1:])
+
+
+def test_parallel_scan_reads_every_segment(tables):
+    add_users(tables, 25)
+    table = CountingTable(tables.user_table)
+    items = list(tables.parallel_scan(table, 4, Limit=2))
+
+    assert sorted(int(item['userId']) for item in items) == list(range(1, 26))
+    assert len(table.threads) == 4
+
+
+def test_parallel_scan_stops_its_workers_when_closed_early(tables):
+    add_users(tables, 60)
+    table = CountingTable(tables.user_table)
+    scan = tables.parallel_scan(table, 4, Limit=2)
+    assert len([next(scan) for _ in range(3)]) == 3
+    scan.close()
+
+    assert not any(thread.is_alive() for thread in table.threads)
+    calls = len(table.start_keys)
+    time.sleep(0.2)
+    assert len(table.start_keys) == calls
+    # Each segment hands over at most a couple of pages past the ones read
+    assert calls < 60 // 2
@@ -0,0 +1,213 @@
+import json
+import hashlib
+import datetime
+import pytest
+import filter
+
+nltk = pytest.importorskip('nltk')
+
+# Tokens around the edges of every pattern, on top of the tokens of the sample statements
+vocabulary = ['today', 'Today', 'tomorrow', 'tmr', 'Tmr', 'mon', 'Monday', 'tues', 'Tuesday', 'wed', 'wednesday',
+              'thurs', 'Thursday', 'fri', 'friday', 'sat', 'saturday', 'sun', 'sunday', 'friend', 'money', 'wedding',
+              'satisfied', 'sunshine', 'month', 'this', 'next', 'following', 'nextdoor', 'thistle', 'jan', 'January',
+              'feb', 'march', 'Mar', 'may', 'June', 'july', 'Aug', 'september', 'Oct', 'november', 'December', 'mayor',
+              'marching', '16', '16th', '1830', '0930', '930', '9:30', '09.30', '2359', '2400', '1260', '12pm', '3pm',
+              '3PM', '13pm', '9:30am', '0am', '31/12', '31/11', '29/2', '29/02/2024', '29/02/2023', '30-4-22',
+              '1.1.2022', '31/12/1999', '1/13', '32/1', '180822', 'buy', 'by', 'on', '.', ',']
+
+
+def corpus():
+    tokenizer = nltk.tokenize.TreebankWordTokenizer()
+    tokens = list(vocabulary)
+    for statement in filter.statements_1 + filter.statements_2:
+        tokens.extend(tokenizer.tokenize(statement))
+    return tokens
+
+
+def test_reg_tag_matches_regexp_tagger():
+    tagger = nltk.RegexpTagger(list(filter.patterns.items()))
+    tokens = corpus()
+    assert filter.reg_tag(tokens) == tagger.tag(tokens)
+
+
+# A Monday
+reference_date = datetime.date(2022, 8, 15)
+
+notes = ['call my friend', 'money for the month', 'the wedding photos', 'satisfied with the result',
+         'sunshine is nice', 'thistle seeds nextdoor', 'Friendly reminder about the todo list']
+
+dated = [
+    ('call my friend on friday', {'deadline': datetime.date(2022, 8, 19), 'time_by': None, 'text': 'call my friend'}),
+    ('buy hamster by tomorrow 1830', {'deadline': datetime.date(2022, 8, 16), 'time_by': datetime.time(18, 30), 'text': 'buy hamster'}),
+    ('money for the month by next monday', {'deadline': datetime.date(2022, 8, 22), 'time_by': None, 'text': 'money for the month'}),
+    ('Find out where is Casey 1330 next wed', {'deadline': datetime.date(2022, 8, 24), 'time_by': datetime.time(13, 30), 'text': 'Find out where is Casey'}),
+    ('going outfield 3pm on sunday', {'deadline': datetime.date(2022, 8, 21), 'time_by': datetime.time(15, 0), 'text': 'going outfield'}),
+    ('buy hamster by 16 march', {'deadline': datetime.date(2023, 3, 16), 'time_by': None, 'text': 'buy hamster'}),
+]
+
+
+def nltk_engine():
+    try:
+        filter.get_pos_tagger()
+        nltk.tokenize.word_tokenize('tmr')
+    except LookupError:
+        pytest.skip('nltk data is not installed')
+
+
+@pytest.mark.parametrize('statement', notes)
+def test_rules_engine_ignores_words_starting_like_days(statement):
+    assert filter.parse_date_rules(statement, reference_date) is None
+
+
+@pytest.mark.parametrize('statement,expected', dated)
+def test_rules_engine(statement, expected):
+    assert filter.parse_date_rules(statement, reference_date) == expected
+
+
+# Where the rules engine is known to differ from the grammar
+differences = {
+    'Date with Casey tmr': 'the grammar needs a verb or a preposition before the day, the rules engine does not',
+    'Finish eco slides by 1500 tmr': 'the rules engine also takes the preposition before a time that precedes the day',
+}
+
+
+def agreement_cases():
+    for statement in notes + [statement for statement, _ in dated] + filter.statements_1 + filter.statements_2:
+        if statement in differences:
+            yield pytest.param(statement, marks=pytest.mark.xfail(reason=differences[statement], strict=True))
+        else:
+            yield statement
+
+
+@pytest.mark.parametrize('statement', list(agreement_cases()))
+def test_engines_agree(statement):
+    nltk_engine()
+    assert filter.parse_date_rules(statement, reference_date) == filter.parse_date(statement, reference_date)
+
+
+@pytest.mark.parametrize('day_adj,val,expected', [
+    (None, 'tue', datetime.date(2022, 8, 16)),
+    ('following', 'tue', datetime.date(2022, 8, 16)),
+    ('next', 'tue', datetime.date(2022, 8, 23)),
+    ('next', 'mon', datetime.date(2022, 8, 22)),
+    ('this', 'mon', datetime.date(2022, 8, 15)),
+    (None, 'mon', datetime.date(2022, 8, 22)),
+])
+def test_resolve_day_matches_parsedatetime(day_adj, val, expected):
+    assert filter.resolve_day(val, day_adj, reference_date) == expected
+    parsedatetime = pytest.importorskip('parsedatetime')
+    text = ' '.join(word for word in (day_adj, val) if word)
+    result, _ = parsedatetime.Calendar(version=parsedatetime.VERSION_CONTEXT_STYLE).parseDT(text, sourceTime=datetime.datetime.combine(reference_date, datetime.time(12)))
+    assert result.date() == expected
+
+
+def test_snapshot_parses_like_nltk_data(tmp_path, monkeypatch):
+    nltk_engine()
+    path = str(tmp_path / 'filter.pickle')
+    filter.save_snapshot(path)
+    expected = filter.parse_date('buy hamster by tomorrow 1830', reference_date)
+    monkeypatch.setattr(filter, 'snapshot_path', path)
+    for loader in (filter.load_snapshot, filter.get_pos_tagger, filter.get_chunk_parser):
+        loader.cache_clear()
+    try:
+        assert filter.parse_date('buy hamster by tomorrow 1830', reference_date) == expected
+    finally:
+        for loader in (filter.load_snapshot, filter.get_pos_tagger, filter.get_chunk_parser):
+            loader.cache_clear()
+
+
+def prefilter_corpus():
+    statements = notes + [statement for statement, _ in dated] + filter.statements_1 + filter.statements_2
+    for token in vocabulary:
+        statements.extend(('buy milk by ' + token, token + ' buy milk', 'buy milk ' + token + ' 1830'))
+    return statements
+
+
+@pytest.mark.parametrize('engine', ['rules', 'nltk'])
+def test_prefilter_keeps_every_dated_statement(engine):
+    if engine == 'nltk':
+        nltk_engine()
+    for statement in prefilter_corpus():
+        if filter.engines[engine](statement, reference_date):
+            assert filter.date_prefilter.search(statement), statement
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """A fresh match_date cache in place of the module's."""
+    cache = filter.MatchDateCache()
+    monkeypatch.setattr(filter, 'match_date_cache', cache)
+    return cache
+
+
+def test_match_date_cache_normalizes_whitespace(cache):
+    expected = filter.match_date('buy hamster by tomorrow 1830', reference_date, 'rules')
+    assert filter.match_date('  buy hamster\tby tomorrow\n1830 ', reference_date, 'rules') == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert list(cache.entries) == [('buy hamster by tomorrow 1830', reference_date, 'rules')]
+
+
+def test_match_date_cache_rolls_over_with_the_reference_date(cache):
+    next_day = reference_date + datetime.timedelta(days=1)
+    assert filter.match_date('call my friend tmr', reference_date, 'rules')['deadline'] == datetime.date(2022, 8, 16)
+    assert filter.match_date('call my friend tmr', next_day, 'rules')['deadline'] == datetime.date(2022, 8, 17)
+    assert cache.misses == 2
+
+
+def test_match_date_cache_evicts_the_least_recently_used(cache):
+    cache.maxsize = 2
+    for statement in ('call my friend tmr', 'call my friend on friday', 'call my friend tmr', 'buy hamster by tomorrow'):
+        filter.match_date(statement, reference_date, 'rules')
+    assert [statement for statement, _, _ in cache.entries] == ['call my friend tmr', 'buy hamster by tomorrow']
+
+
+def test_match_date_cache_shares_results_through_redis(cache):
+    fakeredis = pytest.importorskip('fakeredis')
+    cache.redis_conn = fakeredis.FakeStrictRedis()
+    expected = filter.match_date('buy hamster by tomorrow 1830', reference_date, 'rules')
+    assert filter.match_date('the wedding photos', reference_date, 'rules') is None
+
+    # Another container
+    other = filter.MatchDateCache(redis_conn=cache.redis_conn)
+    key = other.key('buy hamster by tomorrow 1830', reference_date, 'rules')
+    assert other.get(key) == (True, expected)
+    assert other.get(other.key('the wedding photos', reference_date, 'rules')) == (True, None)
+    assert other.get(other.key('buy hamster by tomorrow 1830', reference_date, 'nltk')) == (False, None)
+    assert (other.redis_hits, other.misses) == (2, 1)
+    assert other.get(key) == (True, expected)
+    assert other.hits == 1
+
+
+def test_match_date_cache_ignores_results_of_other_versions(cache, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    cache.redis_conn = fakeredis.FakeStrictRedis()
+    key = cache.key('Date with Casey tmr', reference_date, 'rules')
+    # What a container running the parsers before the last change wrote
+    stale = json.dumps(filter.encode_result({'deadline': datetime.date(2022, 8, 22), 'time_by': None, 'text': 'Date with Casey'}))
+    monkeypatch.setattr(filter, 'cache_version', filter.cache_version - 1)
+    cache.redis_conn.set(cache.redis_key(key), stale)
+    cache.redis_conn.set('match_date:rules:{}:{}'.format(reference_date.isoformat(), hashlib.sha1(key[0].encode()).hexdigest()), stale)
+    monkeypatch.undo()
+
+    assert cache.get(key) == (False, None)
+    assert filter.match_date('Date with Casey tmr', reference_date, 'rules')['deadline'] == datetime.date(2022, 8, 16)
+
+
+@pytest.mark.parametrize('engine', ['rules', 'nltk'])
+def test_match_dates_resolves_each_line(cache, engine):
+    if engine == 'nltk':
+        nltk_engine()
+    lines = [statement for statement, _ in dated] + notes + ['https://example.com/call-my-friend-tmr']
+    results = filter.match_dates(lines, reference_date, engine)
+    assert results[:len(dated)] == [expected for _, expected in dated]
+    assert results[len(dated):] == [None] * (len(notes) + 1)
+    # Lines seen before come from the cache
+    assert filter.match_dates(lines[:2], reference_date, engine) == results[:2]
+
+
+@pytest.mark.parametrize('engine', ['rules', 'nltk'])
+def test_match_dates_without_dates(cache, engine):
+    if engine == 'nltk':
+        nltk_engine()
+    assert filter.match_dates(notes, reference_date, engine) == [None] * len(notes)
+    assert filter.match_dates([], reference_date, engine) == []
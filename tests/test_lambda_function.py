@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+import fakeredis
+import mypersistence
+import lambda_function
+from telegram import Update, User
+
+
+@pytest.fixture(autouse=True)
+def redis_conn(monkeypatch):
+    conn = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(mypersistence, 'redis_conn', conn)
+    monkeypatch.setattr(lambda_function.persistence, 'loaded', False)
+    monkeypatch.setattr(lambda_function.persistence, 'conversations', dict())
+    # What Application.initialize leaves there
+    monkeypatch.setattr(lambda_function.conv_handler, '_conversations', lambda_function.TrackingDict())
+    return conn
+
+
+def message_update(chat_id, text):
+    message = {'message_id': 1, 'date': 0, 'text': text,
+               'chat': {'id': chat_id, 'type': 'private'},
+               'from': {'id': chat_id, 'is_bot': False, 'first_name': 'A'}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return Update.de_json({'update_id': 1, 'message': message}, lambda_function.application.bot)
+
+
+def other_container_moves(key, state):
+    """What a flush by another container leaves in Redis."""
+    other = mypersistence.MyPersistence(None, lambda_function.persistence.redis_key, lambda_function.persistence.store_data,
+                                        60, sharded=True, serializer=mypersistence.default_serializer())
+    other.load_redis()
+    asyncio.run(other.update_conversation('anela_conversation', key, state))
+    asyncio.run(other.flush())
+
+
+def test_refresh_conversation_picks_up_other_containers():
+    lambda_function.persistence.load_redis()
+    lambda_function.conv_handler._conversations.update_no_track({(1, 1): lambda_function.USER_ROUTE})
+    other_container_moves((1, 1), lambda_function.IMPORT_ROUTE)
+
+    asyncio.run(lambda_function.refresh_conversation(message_update(1, 'hello')))
+    assert lambda_function.conv_handler._conversations[(1, 1)] == lambda_function.IMPORT_ROUTE
+    # Loaded without being marked as changed here
+    assert lambda_function.conv_handler._conversations.pop_accessed_write_items() == []
+
+
+def test_refresh_conversation_drops_ended_conversations():
+    other_container_moves((1, 1), lambda_function.USER_ROUTE)
+    lambda_function.persistence.load_redis()
+    lambda_function.conv_handler._conversations.update_no_track({(1, 1): lambda_function.USER_ROUTE})
+    other_container_moves((1, 1), None)
+
+    asyncio.run(lambda_function.refresh_conversation(message_update(1, 'hello')))
+    assert (1, 1) not in lambda_function.conv_handler._conversations
+
+
+def test_refresh_conversation_reads_only_the_updates_key(redis_conn):
+    lambda_function.persistence.load_redis()
+    other_container_moves((2, 2), lambda_function.USER_ROUTE)
+    asyncio.run(lambda_function.refresh_conversation(message_update(1, 'hello')))
+    assert (2, 2) not in lambda_function.conv_handler._conversations
+
+
+def test_refresh_conversation_reinitializes_without_tracking_dict(monkeypatch):
+    calls = list()
+
+    async def record(name):
+        calls.append(name)
+
+    monkeypatch.setattr(lambda_function.conv_handler, '_conversations', dict())
+    monkeypatch.setattr(lambda_function.application, 'shutdown', lambda: record('shutdown'))
+    monkeypatch.setattr(lambda_function.application, 'initialize', lambda: record('initialize'))
+    lambda_function.persistence.load_redis()
+    asyncio.run(lambda_function.refresh_conversation(message_update(1, 'hello')))
+    assert calls == ['shutdown', 'initialize']
+
+
+def test_import_conversation(tables, monkeypatch):
+    import filter
+    import handlers
+    import classes
+    from telegram import Message
+    replies = list()
+    slots = list()
+
+    async def reply_text(self, text, *args, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, 'reply_text', reply_text)
+    monkeypatch.setattr(handlers, 'schedule_slot', slots.append)
+    monkeypatch.setattr(filter, 'default_engine', 'rules')
+    monkeypatch.setattr(filter, 'match_date_cache', filter.MatchDateCache())
+    monkeypatch.setattr(classes, 'user_cache', classes.UserCache())
+    # What initialize() would have fetched with getMe
+    monkeypatch.setattr(lambda_function.application, '_initialized', True)
+    monkeypatch.setattr(lambda_function.application.bot, '_bot_user', User(123, 'AnelaBot', True, username='AnelaBot'))
+    classes.identity_map.clear()
+    tables.add_user(1)
+    lambda_function.persistence.load_redis()
+    lambda_function.conv_handler._conversations.update_no_track({(1, 1): lambda_function.USER_ROUTE})
+
+    def send(text):
+        replies.clear()
+        asyncio.run(lambda_function.application.process_update(message_update(1, text)))
+        return lambda_function.conv_handler._conversations[(1, 1)], replies[-1]
+
+    state, reply = send('/import')
+    assert state == lambda_function.IMPORT_ROUTE
+    state, reply = send('buy hamster by next monday 1830\ncall my friend next friday\n\nhttps://example.com\nbuy milk yesterday')
+    assert state == lambda_function.IMPORT_ROUTE
+    assert reply.startswith('Created 2 reminders, skipped 2 lines')
+    state, reply = send('/view_reminders')
+    assert state == lambda_function.IMPORT_ROUTE
+    assert reply.startswith("You're still importing reminders")
+    state, reply = send('/done')
+    assert state == lambda_function.USER_ROUTE
+
+    assert sorted(item['text'] for item in tables.query_reminders(1)) == ['buy hamster', 'call my friend']
+    assert len(slots) == 1
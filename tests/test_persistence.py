@@ -0,0 +1,224 @@
+import sys
+import asyncio
+import threading
+import pytest
+import fakeredis
+import mypersistence
+from telegram.ext import PersistenceInput
+
+
+@pytest.fixture(autouse=True)
+def redis_conn(monkeypatch):
+    conn = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(mypersistence, 'redis_conn', conn)
+    return conn
+
+
+def new_persistence(sharded=True, max_retries=5):
+    return mypersistence.MyPersistence(None, 'test', PersistenceInput(chat_data=False, bot_data=False), 60, sharded=sharded,
+                                       serializer=mypersistence.default_serializer(), max_retries=max_retries)
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+async def save_user(persistence, user_id, data):
+    await persistence.update_user_data(user_id, data)
+    await persistence.flush()
+
+
+def test_sharded_load_reads_no_user_entries():
+    writer = new_persistence()
+    writer.load_redis()
+    run(save_user(writer, 1, {'a': 1}))
+
+    reader = new_persistence()
+    assert run(reader.get_user_data()) == {}
+    assert reader.user_snapshots == {}
+
+
+def test_refresh_user_data_loads_one_entry():
+    writer = new_persistence()
+    writer.load_redis()
+    run(save_user(writer, 1, {'a': 1}))
+    run(save_user(writer, 2, {'b': 2}))
+
+    reader = new_persistence()
+    user_data = run(reader.get_user_data())
+    run(reader.refresh_user_data(1, user_data[1]))
+    assert user_data[1] == {'a': 1}
+    assert list(reader.user_snapshots) == [1]
+
+
+def test_refresh_user_data_picks_up_other_writers():
+    first, second = new_persistence(), new_persistence()
+    first_data, second_data = run(first.get_user_data()), run(second.get_user_data())
+    run(first.refresh_user_data(1, first_data[1]))
+    first_data[1]['a'] = 1
+    run(save_user(first, 1, first_data[1]))
+
+    run(second.refresh_user_data(1, second_data[1]))
+    assert second_data[1] == {'a': 1}
+    second_data[1]['b'] = 2
+    run(save_user(second, 1, second_data[1]))
+
+    # A warm container sees the newer entry on its next update
+    run(first.refresh_user_data(1, first_data[1]))
+    assert first_data[1] == {'a': 1, 'b': 2}
+
+
+def test_refresh_keeps_unflushed_changes():
+    first, second = new_persistence(), new_persistence()
+    data = run(first.get_user_data())
+    run(first.update_user_data(1, {'mine': True}))
+    run(save_user(second, 1, {'theirs': True}))
+    data[1]['mine'] = True
+    run(first.refresh_user_data(1, data[1]))
+    assert data[1] == {'mine': True}
+
+
+def test_drop_user_data_deletes_unread_entry(redis_conn):
+    writer = new_persistence()
+    writer.load_redis()
+    run(save_user(writer, 1, {'a': 1}))
+
+    dropper = new_persistence()
+    dropper.load_redis()
+    run(dropper.drop_user_data(1))
+    run(dropper.flush())
+    assert redis_conn.hget('test:user_data', '1') is None
+
+
+@pytest.fixture
+def lua():
+    pytest.importorskip('lupa', reason='fakeredis needs lupa to run Lua scripts')
+
+
+def concurrent_flushes(count, work, max_retries=5):
+    """Runs work(persistence, i) on count threads, each with its own persistence like concurrent
+    Lambda containers, then flushes all of them at once and returns the exceptions raised."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def target(i):
+        persistence = new_persistence(max_retries=max_retries)
+        persistence.load_redis()
+        run(work(persistence, i))
+        barrier.wait()
+        try:
+            run(persistence.flush())
+        except Exception as e:
+            errors.append(e)
+
+    # Switch threads as often as possible so the flushes interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return errors
+
+
+def test_concurrent_flushes_of_different_users_do_not_conflict(lua, redis_conn):
+    async def work(persistence, i):
+        data = (await persistence.get_user_data())[i]
+        await persistence.refresh_user_data(i, data)
+        data['n'] = i
+        await persistence.update_user_data(i, data)
+        await persistence.update_conversation('anela_conversation', (i, i), i)
+
+    # Without retries, so any conflict between different users fails the flush
+    assert concurrent_flushes(30, work, max_retries=1) == []
+    reader = new_persistence()
+    user_data = run(reader.get_user_data())
+    for i in range(30):
+        run(reader.refresh_user_data(i, user_data[i]))
+        assert user_data[i] == {'n': i}
+    assert len(run(reader.get_conversations('anela_conversation'))) == 30
+
+
+def test_concurrent_flushes_of_one_user_merge(lua):
+    async def work(persistence, i):
+        data = (await persistence.get_user_data())[0]
+        await persistence.refresh_user_data(0, data)
+        data[i] = True
+        await persistence.update_user_data(0, data)
+
+    assert concurrent_flushes(5, work) == []
+    persistence = new_persistence()
+    data = run(persistence.get_user_data())[0]
+    run(persistence.refresh_user_data(0, data))
+    assert data == {i: True for i in range(5)}
+
+
+def test_blob_mode_loads_everything():
+    writer = new_persistence(sharded=False)
+    writer.load_redis()
+    run(save_user(writer, 1, {'a': 1}))
+
+    reader = new_persistence(sharded=False)
+    assert run(reader.get_user_data()) == {1: {'a': 1}}
+
+
+def test_reencode_marks_every_loaded_entry(redis_conn):
+    writer = mypersistence.MyPersistence(None, 'test', PersistenceInput(chat_data=False, bot_data=False), 60,
+                                         serializer=mypersistence.PickleSerializer())
+    writer.load_redis()
+    run(save_user(writer, 1, {'a': 1}))
+    run(writer.update_conversation('anela_conversation', (1, 1), 2))
+    run(writer.flush())
+
+    persistence = new_persistence(sharded=False)
+    persistence.load_redis()
+    assert not persistence.dirty
+    persistence.reencode()
+    assert persistence.dirty
+    assert persistence.user_snapshots[1].startswith(mypersistence.MsgpackSerializer.MAGIC)
+    run(persistence.flush())
+
+    reader = new_persistence(sharded=False)
+    assert run(reader.get_user_data()) == {1: {'a': 1}}
+    assert run(reader.get_conversations('anela_conversation')) == {(1, 1): 2}
+    assert reader.user_snapshots[1] == persistence.user_snapshots[1]
+
+
+def test_rewrite_persistence_replaces_pickle(redis_conn, monkeypatch):
+    import migrations
+    writer = mypersistence.MyPersistence(None, 'test', PersistenceInput(chat_data=False, bot_data=False), 60,
+                                         sharded=True, serializer=mypersistence.PickleSerializer())
+    writer.load_redis()
+    run(save_user(writer, 1, {'a': 1}))
+    run(writer.update_conversation('anela_conversation', (1, 1), 2))
+    run(writer.flush())
+    # The blob left behind by deployments from before sharding
+    redis_conn.set('test', mypersistence.PickleSerializer().dumps(
+        {'conversations': {}, 'user_data': {2: {'b': 2}}, 'chat_data': {}}))
+
+    migrations.rewrite_persistence()
+
+    monkeypatch.setattr(mypersistence, 'legacy_pickle', False)
+    serializer = mypersistence.default_serializer()
+    for key in ('test:user_data', 'test:conversations'):
+        for data in redis_conn.hgetall(key).values():
+            serializer.loads(data)
+    blob = serializer.loads(redis_conn.get('test'))
+    assert serializer.loads(blob['user_data'][2]) == {'b': 2}
+
+    reader = mypersistence.MyPersistence(None, 'test', PersistenceInput(chat_data=False, bot_data=False), 60,
+                                         sharded=True, serializer=serializer)
+    user_data = run(reader.get_user_data())
+    run(reader.refresh_user_data(1, user_data[1]))
+    assert user_data[1] == {'a': 1}
+    assert run(reader.get_conversations('anela_conversation')) == {(1, 1): 2}
+
+
+def test_pickle_reads_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(mypersistence, 'legacy_pickle', False)
+    with pytest.raises(ValueError):
+        mypersistence.default_serializer().loads(mypersistence.PickleSerializer().dumps({'a': 1}))
@@ -0,0 +1,18 @@
+import time
+import asyncio
+from ratelimit import RateLimiter
+
+
+def test_rate_limiter_allows_a_burst_then_paces():
+    async def acquire_all(limiter, count):
+        times = list()
+        for _ in range(count):
+            await limiter.acquire()
+            times.append(time.monotonic())
+        return times
+
+    start = time.monotonic()
+    times = asyncio.run(acquire_all(RateLimiter(20, burst=5), 10))
+    assert times[4] - start < 0.1
+    # The 5 after the burst come one every 1 / rate seconds
+    assert times[9] - start >= 5 / 20 - 0.02
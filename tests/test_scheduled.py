@@ -0,0 +1,94 @@
+import asyncio
+import json
+import pytest
+import scheduled
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Messages sent to the Bot API, as (chat_id, text)."""
+    messages = list()
+
+    async def send_message(chat_id, text):
+        messages.append((chat_id, text))
+        return {'message_id': len(messages)}
+
+    monkeypatch.setattr(scheduled, 'send_message', send_message)
+    return messages
+
+
+def add_due(tables, user_id, text, due_at='2027-03-16T10:30'):
+    return tables.add_reminder(user_id, text, '16#03#2027', '18#30', due_at)
+
+
+def test_remind_slot_skips_items_without_user(tables, sent):
+    add_due(tables, 1, 'first')
+    ghost = add_due(tables, 2, 'ghost')
+    # What an unconditional update of a deleted reminder leaves behind
+    tables.reminder_table.delete_item(Key={'Id': ghost})
+    tables.reminder_table.put_item(Item={'Id': ghost, 'dueAt': '2027-03-16T10:30',
+                                         'dueBucket': tables.due_bucket(ghost, '2027-03-16T10:30')})
+
+    response = asyncio.run(scheduled.remind_slot({'slot': '2027-03-16T10:30'}))
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['sent'] == 1
+    assert sent == [(1, 'Reminder: first\n(by 18:30)')]
+
+
+def test_backfill_due_at_skips_reminders_changed_since_the_scan(tables, monkeypatch):
+    import migrations
+    monkeypatch.setattr(migrations, 'schedule_slot', lambda due_at: None)
+    tables.add_user(1)
+    kept = tables.add_reminder(1, 'kept', '16#03#2027', '18#30')
+    deleted = tables.add_reminder(1, 'deleted', '16#03#2027', '18#30')
+    items = list(tables.paginate(tables.reminder_table.scan))
+    tables.delete_reminder(deleted)
+    monkeypatch.setattr(tables, 'paginate', lambda operation, **kwargs: iter(items))
+
+    assert migrations.backfill_due_at() == 1
+    assert tables.query_reminder(deleted) is None
+    assert tables.query_reminder(kept)['dueAt'] == '2027-03-16T10:30'
+
+
+def failing_send(monkeypatch, errors):
+    """Replaces send_message with one raising errors[chat_id] once per entry, if any."""
+    messages = list()
+
+    async def send_message(chat_id, text):
+        if errors.get(chat_id):
+            raise scheduled.ApiError(errors[chat_id].pop(0))
+        messages.append((chat_id, text))
+        return {'message_id': len(messages)}
+
+    monkeypatch.setattr(scheduled, 'send_message', send_message)
+    return messages
+
+
+def test_remind_slot_waits_out_rate_limits(tables, monkeypatch):
+    add_due(tables, 1, 'first')
+    messages = failing_send(monkeypatch, {1: [{'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                                               'parameters': {'retry_after': 0.01}}]})
+    response = asyncio.run(scheduled.remind_slot({'slot': '2027-03-16T10:30'}))
+    assert json.loads(response['body'])['sent'] == 1
+    assert messages == [(1, 'Reminder: first\n(by 18:30)')]
+
+
+def test_remind_slot_does_not_retry_blocked_users(tables, monkeypatch):
+    add_due(tables, 1, 'first')
+    failing_send(monkeypatch, {1: [{'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}]})
+    response = asyncio.run(scheduled.remind_slot({'slot': '2027-03-16T10:30'}))
+    assert json.loads(response['body'])['blocked'] == 1
+
+
+def test_remind_slot_fails_and_retries_only_unsent(tables, monkeypatch):
+    add_due(tables, 1, 'first')
+    add_due(tables, 2, 'second')
+    messages = failing_send(monkeypatch, {2: [{'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}]})
+    with pytest.raises(Exception):
+        asyncio.run(scheduled.handle({'action': 'remind_slot', 'slot': '2027-03-16T10:30'}))
+    assert messages == [(1, 'Reminder: first\n(by 18:30)')]
+
+    # The retry Scheduler gets from the failed invocation
+    response = asyncio.run(scheduled.handle({'action': 'remind_slot', 'slot': '2027-03-16T10:30'}))
+    assert json.loads(response['body'])['sent'] == 1
+    assert messages == [(1, 'Reminder: first\n(by 18:30)'), (2, 'Reminder: second\n(by 18:30)')]